@@ -0,0 +1,363 @@
+"""複数ユーザーが同時にクイズを解く状況のオフライン負荷試験
+
+使い方:
+    python -m benchmarks.load_test [--users 10] [--gpt-latency 0.5] [--gpt-error-rate 0.05]
+
+Streamlitのテスト用ランナー（AppTest）で streamlit_app.py を実際に動かし、
+ログイン → 回答（show_quiz_screen → handle_answer → record_answer）→
+結果画面（show_result_screen）までをユーザーごとのスレッドで繰り返す。
+OpenAIとGoogle Sheetsはutils.offlineのスタンドインに置き換え、遅延と
+エラー率を指定できる。スループット、再実行（rerun）の待ち時間の
+パーセンタイル、セッションあたりのメモリ、外部APIの呼び出し回数を
+表示し、JSONで書き出す。
+"""
+import os
+import atexit
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from utils import config, timing
+from utils.offline import OFFLINE_SECRETS, use_offline_services
+from utils.logger import log_policy
+
+APP_PATH = os.path.join(PROJECT_ROOT, 'streamlit_app.py')
+DEFAULT_OUTPUT = os.path.join('reports', 'load_test.json')
+DEFAULT_TIMEOUT = 120.0
+# 1ユーザーあたりの操作回数の上限（画面が進まない場合の打ち切り）
+MAX_STEPS = 200
+
+RESULT_TITLE = "🙌クイズ完了"
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _sizeof(value):
+    """セッション状態の値のおおよそのサイズ（__slots__とnumpy配列を展開）"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes + sys.getsizeof(np.empty(0))
+    size = sys.getsizeof(value)
+    for name in getattr(type(value), '__slots__', ()):
+        attr = getattr(value, name, None)
+        # 共有の難易度モデルはセッションの持ち物ではない
+        if attr is not None and name != 'model':
+            size += _sizeof(attr)
+    return size
+
+class SimulatedUser:
+    """1人分のユーザー操作をAppTestで再現する"""
+    def __init__(self, index, seed, timeout=DEFAULT_TIMEOUT):
+        from streamlit.testing.v1 import AppTest
+
+        self.nickname = f'loadtest-{index}'
+        self.random = random.Random(seed)
+        self.latencies = {'login': [], 'answer': [], 'navigate': []}
+        self.answers = 0
+        self.error = None
+        self.session_bytes = None
+        self.app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    def _run(self, kind):
+        started_at = time.perf_counter()
+        self.app.run()
+        self.latencies[kind].append((time.perf_counter() - started_at) * 1000)
+        if self.app.exception:
+            raise RuntimeError(self.app.exception[0].message)
+
+    def _button(self, label):
+        for button in self.app.button:
+            if button.label == label:
+                return button
+        return None
+
+    def play(self):
+        """ログインから結果画面まで進める"""
+        try:
+            self.app.run()
+            self.app.text_input[0].input(self.nickname)
+            self._button('開始').click()
+            self._run('login')
+
+            for _ in range(MAX_STEPS):
+                if self.app.title and self.app.title[0].value == RESULT_TITLE:
+                    break
+                finish = self._button('結果を見る🎖️')
+                next_question = self._button('次の問題へ ➡️')
+                if finish is not None:
+                    finish.click()
+                    self._run('navigate')
+                elif next_question is not None:
+                    next_question.click()
+                    self._run('navigate')
+                else:
+                    radio = self.app.radio[0]
+                    radio.set_value(self.random.choice(radio.options))
+                    self._button('回答を確定する').click()
+                    self._run('answer')
+                    self.answers += 1
+            else:
+                raise RuntimeError("結果画面に到達しませんでした")
+
+            state = self.app.session_state
+            self.session_bytes = sum(
+                _sizeof(state[key]) for key in ('quiz_state', 'scheduler')
+                if key in state and state[key] is not None
+            )
+        except Exception as e:
+            self.error = f'{type(e).__name__}: {str(e)}'
+        return self
+
+def _percentiles(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': len(values),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'max_ms': float(max(values)),
+    }
+
+def _prepare_app_test():
+    """AppTestを複数スレッドから同時に使えるようにする
+
+    AppTestはrerunのたびにRuntimeのインスタンス・st.secrets・設定値を
+    プロセス全体で差し替えるため、そのままでは同時に実行できない。
+    実際のサーバーと同じく、これらはプロセスで1つを共有するように固定する。
+    スクリプトのコンパイル結果も共有する（AppTestはrerunのたびに
+    構文解析し直すが、CPython 3.11のast.parseは複数スレッドから同時に
+    呼ぶと失敗することがある）。
+    """
+    import streamlit as st
+    from unittest.mock import MagicMock
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+
+    secrets = Secrets()
+    secrets._secrets = {'gsheet': {'spreadsheet_id': OFFLINE_SECRETS['SPREADSHEET_ID']}}
+    st.secrets = secrets
+    from streamlit import config as st_config
+    st_config.get_config_options()
+    st_config._set_option('global.appTest', True, 'test')
+
+    original = ScriptCache.get_bytecode
+    lock = threading.Lock()
+    compiled = {}
+
+    def get_bytecode(self, script_path):
+        with lock:
+            if script_path not in compiled:
+                compiled[script_path] = original(self, script_path)
+            return compiled[script_path]
+
+    ScriptCache.get_bytecode = get_bytecode
+
+def _prepare_workdir(workdir, with_explanations):
+    """問題データ（と事前計算済みの解説）を作業ディレクトリから参照できるようにする"""
+    paths = [config.QUIZ_DATA_PATH]
+    if with_explanations:
+        paths.append(config.EXPLANATIONS_PATH)
+    for path in paths:
+        source = os.path.join(PROJECT_ROOT, path)
+        if not os.path.exists(source):
+            continue
+        target = os.path.join(workdir, path)
+        os.makedirs(os.path.dirname(target) or workdir, exist_ok=True)
+        os.symlink(source, target)
+
+def _final_sync():
+    """ログを書き込み、Google Sheetsへの同期を最後まで行う"""
+    from utils.log_store import start_replicator
+    from utils.logger import setup_logger
+
+    for handler in setup_logger().logger.handlers:
+        handler.flush()
+    timing.export_spans()
+    replicator = start_replicator(config.get_spreadsheet_id())
+    try:
+        while replicator.sync_once():
+            pass
+    except Exception as e:
+        print(f"Google Sheetsへの最終同期に失敗: {str(e)}")
+
+def run_load_test(
+    users=10,
+    gpt_latency=0.5,
+    gpt_error_rate=0.0,
+    sheets_latency=0.2,
+    sheets_error_rate=0.0,
+    seed=0,
+    with_explanations=False,
+    timeout=DEFAULT_TIMEOUT
+):
+    """負荷試験を実行し、レポートの辞書を返す
+
+    カレントディレクトリは使い捨ての作業ディレクトリに移り、プロセスの終了時に削除する。
+    """
+    services = use_offline_services(
+        sheets_latency=sheets_latency,
+        sheets_error_rate=sheets_error_rate,
+        gpt_latency=gpt_latency,
+        gpt_error_rate=gpt_error_rate,
+        seed=seed
+    )
+
+    _prepare_app_test()
+
+    # ログDB・キャッシュは相対パスなので、終了時の書き出しまで作業ディレクトリに留まる。
+    # 先に登録したatexitは最後に実行されるため、削除は他の終了処理の後になる
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    atexit.register(shutil.rmtree, workdir, True)
+    _prepare_workdir(workdir, with_explanations)
+    os.chdir(workdir)
+
+    simulated = [SimulatedUser(i, seed + i, timeout) for i in range(users)]
+    rss_before = _peak_rss_kb()
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        finished = list(executor.map(SimulatedUser.play, simulated))
+    elapsed = time.perf_counter() - started_at
+    rss_after = _peak_rss_kb()
+
+    _final_sync()
+    from utils.gpt import evaluation_cache
+    cache_stats = evaluation_cache.stats()
+
+    latencies = {kind: [] for kind in ('login', 'answer', 'navigate')}
+    for user in finished:
+        for kind, values in user.latencies.items():
+            latencies[kind].extend(values)
+    all_latencies = [value for values in latencies.values() for value in values]
+    answers = sum(user.answers for user in finished)
+    session_bytes = [user.session_bytes for user in finished if user.session_bytes is not None]
+
+    return {
+        'config': {
+            'users': users,
+            'gpt_latency': gpt_latency,
+            'gpt_error_rate': gpt_error_rate,
+            'sheets_latency': sheets_latency,
+            'sheets_error_rate': sheets_error_rate,
+            'seed': seed,
+            'with_explanations': with_explanations,
+        },
+        'elapsed_seconds': elapsed,
+        'completed_users': sum(1 for user in finished if user.error is None),
+        'errors': [user.error for user in finished if user.error],
+        'throughput': {
+            'answers_per_second': answers / elapsed if elapsed else None,
+            'reruns_per_second': len(all_latencies) / elapsed if elapsed else None,
+        },
+        'rerun_latency': {
+            'all': _percentiles(all_latencies),
+            **{kind: _percentiles(values) for kind, values in latencies.items()},
+        },
+        'memory': {
+            'rss_delta_kb_per_user': (
+                (rss_after - rss_before) / users if rss_before is not None else None
+            ),
+            'session_state_bytes': float(np.mean(session_bytes)) if session_bytes else None,
+        },
+        'upstream_calls': {
+            'openai': {
+                'calls': services.openai.calls,
+                'stream_calls': services.openai.stream_calls,
+                'injected_errors': services.openai.errors,
+            },
+            'sheets': {
+                'calls': dict(services.spreadsheets.calls),
+                'injected_errors': services.spreadsheets.errors,
+                'rows_appended': sum(len(rows) for rows in services.spreadsheets.rows.values()),
+            },
+            'gpt_cache': cache_stats,
+        },
+        'suppressed_logs': log_policy.stats(),
+        'spans': timing.snapshot(),
+    }
+
+def print_summary(report):
+    """レポートの概要を表示"""
+    print(f"ユーザー数: {report['config']['users']}  完了: {report['completed_users']}  "
+          f"経過時間: {report['elapsed_seconds']:.1f}秒")
+    throughput = report['throughput']
+    print(f"スループット: {throughput['answers_per_second']:.2f} 回答/秒, "
+          f"{throughput['reruns_per_second']:.2f} rerun/秒")
+    print(f"{'rerun':<10} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind, stats in report['rerun_latency'].items():
+        if stats:
+            print(f"{kind:<10} {stats['count']:>6} {stats['p50_ms']:>9.1f} "
+                  f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+    memory = report['memory']
+    print(f"メモリ: RSS増分 {memory['rss_delta_kb_per_user']} KB/ユーザー, "
+          f"セッション状態 {memory['session_state_bytes']} バイト")
+    upstream = report['upstream_calls']
+    print(f"OpenAI呼び出し: {upstream['openai']['calls']}（注入エラー {upstream['openai']['injected_errors']}）")
+    print(f"Google Sheets呼び出し: {upstream['sheets']['calls']}（注入エラー {upstream['sheets']['injected_errors']}）")
+    print(f"GPTキャッシュ: {upstream['gpt_cache']}")
+    print(f"抑制したログ: {report['suppressed_logs']}")
+    for error in report['errors']:
+        print(f"エラー: {error}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="複数ユーザーのクイズをオフラインで同時に実行する")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--gpt-latency', type=float, default=0.5, help="GPTの応答までの秒数")
+    parser.add_argument('--gpt-error-rate', type=float, default=0.0)
+    parser.add_argument('--sheets-latency', type=float, default=0.2, help="Google Sheetsの応答までの秒数")
+    parser.add_argument('--sheets-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--with-explanations', action='store_true', help="事前計算済みの解説を使う")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help="1回のrerunの最大秒数")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    args = parser.parse_args(argv)
+    # 実行中は作業ディレクトリを移るので、出力先は先に絶対パスにしておく
+    output = os.path.abspath(args.output)
+
+    report = run_load_test(
+        users=args.users,
+        gpt_latency=args.gpt_latency,
+        gpt_error_rate=args.gpt_error_rate,
+        sheets_latency=args.sheets_latency,
+        sheets_error_rate=args.sheets_error_rate,
+        seed=args.seed,
+        with_explanations=args.with_explanations,
+        timeout=args.timeout
+    )
+    print_summary(report)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"レポートを {args.output} に書き出しました")
+    return 0 if not report['errors'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
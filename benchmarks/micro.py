@@ -0,0 +1,339 @@
+"""ログ出力・問題データの読み込み・回答処理のマイクロベンチマーク
+
+使い方:
+    python -m benchmarks.micro [--filter jst] [--output reports/micro.json]
+    python -m benchmarks.micro --compare [--threshold 0.25]
+    python -m benchmarks.micro --save-baseline
+
+各ベンチマークは1回あたりの処理時間を複数ラウンド計測する。--compare は
+リポジトリに保存したベースライン（benchmarks/baseline.json）と最速ラウンドの
+時間（他の負荷の影響を受けにくい）を比べ、しきい値を超えて遅くなったものが
+あれば終了コード1で終わる。
+ベースラインは計測したマシンに依存するので、比較は同じマシンで行う。
+Google Sheetsはutils.offlineのフェイクを使い、ネットワークには接続しない。
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import random
+import itertools
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime, timezone
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from utils.offline import OFFLINE_SECRETS, use_offline_services
+from utils.profile_startup import _git_revision
+
+BASELINE_PATH = os.path.join(PROJECT_ROOT, 'benchmarks', 'baseline.json')
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_ROUNDS = 7
+# 1ラウンドの最短時間（秒）。短い処理はこの時間を超えるまで繰り返す
+MIN_ROUND_TIME = 0.05
+
+# 生成するデータの大きさ
+LOG_ROWS = 100_000
+WORKBOOK_ROWS = 5_000
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_DATEFMT = '%Y-%m-%d %H:%M:%S %Z'
+
+EVALUATION_RESPONSE = """
+        RESULT:[INCORRECT]
+        あなたの回答: A) 多額の現金と貴重品
+        正解: B) パスポートとクレジットカード
+        解説: 多額の現金や貴重品は盗難のリスクが高いため、パスポートとクレジットカードを持ち歩くのが安全です。
+        """
+
+# {名前: (fixtureを受け取り計測する関数を返すファクトリ, ラウンド数)}
+BENCHMARKS = {}
+
+def benchmark(name, rounds=DEFAULT_ROUNDS):
+    """ベンチマークを登録するデコレータ"""
+    def decorator(factory):
+        BENCHMARKS[name] = (factory, rounds)
+        return factory
+    return decorator
+
+def _log_record(message='ユーザー[user1] - 問題表示 - 問題番号: 1'):
+    return logging.makeLogRecord({
+        'name': 'xlsx_data_app',
+        'user_id': 'user1',
+        'levelno': logging.INFO,
+        'levelname': 'INFO',
+        'msg': message,
+        'created': time.time(),
+    })
+
+def _log_records(count=1000):
+    """同じ時刻帯に作られた別々のレコード（大量にログを出すときの状況）"""
+    return itertools.cycle([
+        _log_record(f'ユーザー[user{i % 200}] - 問題表示 - 問題番号: {i % 30 + 1}')
+        for i in range(count)
+    ])
+
+@benchmark('jst_formatter_format')
+def bench_jst_formatter(workdir, services):
+    from utils.logger import JSTFormatter
+
+    formatter = JSTFormatter(LOG_FORMAT, datefmt=LOG_DATEFMT)
+    records = _log_records()
+    return lambda: formatter.format(next(records))
+
+@benchmark('jst_formatter_two_handlers')
+def bench_jst_formatter_two_handlers(workdir, services):
+    from utils.logger import JSTFormatter
+
+    # setup_loggerと同じく、SQLiteとコンソールのハンドラが1つのフォーマッタを共有する
+    formatter = JSTFormatter(LOG_FORMAT, datefmt=LOG_DATEFMT)
+    records = _log_records()
+
+    def format_twice():
+        record = next(records)
+        formatter.format(record)
+        return formatter.format(record)
+    return format_twice
+
+def _sheets_handler(async_mode):
+    from utils.logger import GoogleSheetsHandler, JSTFormatter
+
+    handler = GoogleSheetsHandler(
+        OFFLINE_SECRETS['SPREADSHEET_ID'],
+        async_mode=async_mode,
+        drop_policy='drop_oldest'
+    )
+    handler.setFormatter(JSTFormatter(LOG_FORMAT, datefmt=LOG_DATEFMT))
+    return handler
+
+@benchmark('sheets_handler_emit_sync')
+def bench_sheets_emit_sync(workdir, services):
+    handler = _sheets_handler(async_mode=False)
+    records = _log_records()
+    return lambda: handler.emit(next(records))
+
+@benchmark('sheets_handler_emit_async')
+def bench_sheets_emit_async(workdir, services):
+    handler = _sheets_handler(async_mode=True)
+    records = _log_records()
+    return lambda: handler.emit(next(records))
+
+def _log_rows(count, seed=0):
+    """ログシートの行を生成（ユーザー200人、レベルは混在）"""
+    rng = random.Random(seed)
+    levels = ['INFO'] * 8 + ['WARNING', 'ERROR']
+    rows = []
+    for i in range(count):
+        user = f'user{rng.randrange(200)}'
+        level = rng.choice(levels)
+        rows.append([
+            f"2025-01-01 12:{i // 60 % 60:02d}:{i % 60:02d} JST - xlsx_data_app - {level} - "
+            f"ユーザー[{user}] - 正解 - 問題番号: {i % 30 + 1}, ユーザー回答: B) パスポートとクレジットカード"
+        ])
+    return rows
+
+@benchmark('get_logs_filter_100k', rounds=5)
+def bench_get_logs(workdir, services):
+    from utils.logger import get_logs
+
+    services.spreadsheets.rows['logs'] = _log_rows(LOG_ROWS)
+    return lambda: get_logs(
+        OFFLINE_SECRETS['SPREADSHEET_ID'], user_id='user42', level='INFO', limit=100
+    )
+
+def _generate_workbook(path, count, seed=0):
+    """問題シートと同じ列を持つExcelファイルを生成"""
+    import pandas as pd
+    from utils.config import SHEET_NAME
+
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        options = [f'{letter}) 選択肢{letter}-{i}' for letter in 'ABC']
+        question = f'問題{i}の本文です。次のうち正しいものはどれでしょうか？'
+        rows.append({
+            '問題': question + '\n\n' + '\n'.join(options),
+            '回答': f'回答：{rng.choice(options)}\n\n',
+            '選択肢A': options[0],
+            '選択肢B': options[1],
+            '選択肢C': options[2],
+            '質問': question,
+        })
+    pd.DataFrame(rows).to_excel(path, sheet_name=SHEET_NAME)
+    return path
+
+@benchmark('load_data_cold', rounds=3)
+def bench_load_data_cold(workdir, services):
+    from utils.question_bank import load_question_bank, compiled_path_for
+    from utils.config import SHEET_NAME
+
+    source = _generate_workbook(os.path.join(workdir, 'large.xlsx'), WORKBOOK_ROWS)
+    compiled = compiled_path_for(source, SHEET_NAME, os.path.join(workdir, 'compiled'))
+
+    def load_cold():
+        # Excelの読み込みとコンパイルを毎回行う
+        if os.path.exists(compiled):
+            os.remove(compiled)
+        return load_question_bank(source, SHEET_NAME, compiled)
+    return load_cold
+
+@benchmark('load_data_warm')
+def bench_load_data_warm(workdir, services):
+    from utils.question_bank import load_question_bank, compiled_path_for
+    from utils.config import SHEET_NAME
+
+    source = os.path.join(workdir, 'large.xlsx')
+    if not os.path.exists(source):
+        _generate_workbook(source, WORKBOOK_ROWS)
+    compiled = compiled_path_for(source, SHEET_NAME, os.path.join(workdir, 'compiled'))
+    load_question_bank(source, SHEET_NAME, compiled)
+    return lambda: load_question_bank(source, SHEET_NAME, compiled)
+
+@benchmark('parse_evaluation')
+def bench_parse_evaluation(workdir, services):
+    from utils.gpt import parse_evaluation
+
+    return lambda: parse_evaluation(EVALUATION_RESPONSE, 'A) 多額の現金と貴重品')
+
+def _calibrate(func):
+    """1ラウンドがMIN_ROUND_TIMEを超える繰り返し回数"""
+    iterations = 1
+    while True:
+        started_at = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - started_at
+        if elapsed >= MIN_ROUND_TIME:
+            return iterations
+        iterations *= 2 if elapsed <= 0 else max(2, int(MIN_ROUND_TIME / elapsed * 1.2))
+
+def measure(func, rounds=DEFAULT_ROUNDS):
+    """funcの1回あたりの処理時間（マイクロ秒）の統計"""
+    iterations = _calibrate(func)
+    samples = []
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        samples.append((time.perf_counter() - started_at) / iterations * 1e6)
+    return {
+        'rounds': rounds,
+        'iterations': iterations,
+        'min_us': min(samples),
+        'median_us': statistics.median(samples),
+        'mean_us': statistics.mean(samples),
+        'stdev_us': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+def run_benchmarks(names=None):
+    """ベンチマークを実行し、結果の辞書を返す
+
+    ログDBなどの相対パスは使い捨ての作業ディレクトリに向け、プロセスの終了時に削除する。
+    """
+    workdir = tempfile.mkdtemp(prefix='micro_bench_')
+    atexit.register(shutil.rmtree, workdir, True)
+    os.chdir(workdir)
+    services = use_offline_services()
+
+    results = {}
+    for name, (factory, rounds) in BENCHMARKS.items():
+        if names and not any(pattern in name for pattern in names):
+            continue
+        try:
+            results[name] = measure(factory(workdir, services), rounds)
+        except Exception as e:
+            results[name] = {'error': f'{type(e).__name__}: {str(e)}'}
+        print(_format_row(name, results[name]))
+
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'benchmarks': results,
+    }
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """最速ラウンドの時間を比べ、(名前, ベースライン, 今回, 変化率, 劣化か) のリストを返す"""
+    rows = []
+    for name, result in current['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None or 'min_us' not in base or 'min_us' not in result:
+            continue
+        change = result['min_us'] / base['min_us'] - 1
+        rows.append((name, base['min_us'], result['min_us'], change, change > threshold))
+    return rows
+
+def _format_row(name, result):
+    if 'error' in result:
+        return f"{name:<28} {'error':>12}  {result['error']}"
+    return (f"{name:<28} {result['median_us']:>12.2f} {result['min_us']:>12.2f} "
+            f"{result['stdev_us']:>10.2f} {result['iterations']:>8}")
+
+def print_comparison(rows, threshold):
+    print(f"{'benchmark':<28} {'baseline us':>12} {'current us':>12} {'change':>8}")
+    for name, base, current, change, regressed in rows:
+        mark = '  劣化' if regressed else ''
+        print(f"{name:<28} {base:>12.2f} {current:>12.2f} {change:>+8.1%}{mark}")
+    regressions = [row[0] for row in rows if row[4]]
+    if regressions:
+        print(f"しきい値（{threshold:.0%}）を超えて遅くなったベンチマーク: {', '.join(regressions)}")
+    else:
+        print(f"しきい値（{threshold:.0%}）を超える劣化はありません")
+    return regressions
+
+def _write_json(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ホットパスのマイクロベンチマークを実行する")
+    parser.add_argument('--filter', action='append', help="名前に含まれる文字列で絞り込む（複数指定可）")
+    parser.add_argument('--output', default=None, help="結果を書き出すJSONファイル")
+    parser.add_argument('--compare', action='store_true', help="ベースラインと比較する")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="劣化とみなす処理時間の増加率（0.25で25%%）")
+    parser.add_argument('--save-baseline', action='store_true', help="結果をベースラインとして保存する")
+    args = parser.parse_args(argv)
+    # 実行中は作業ディレクトリを移るので、パスは先に絶対パスにしておく
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline)
+
+    print(f"{'benchmark':<28} {'median us':>12} {'min us':>12} {'stdev us':>10} {'iters':>8}")
+    report = run_benchmarks(args.filter)
+
+    if output:
+        _write_json(output, report)
+        print(f"結果を {args.output} に書き出しました")
+
+    if args.save_baseline:
+        baseline = dict(report)
+        if args.filter and os.path.exists(baseline_path):
+            # 一部だけ計測した場合は残りのベースラインを保持する
+            with open(baseline_path, encoding='utf-8') as f:
+                baseline['benchmarks'] = {**json.load(f)['benchmarks'], **report['benchmarks']}
+        _write_json(baseline_path, baseline)
+        print(f"ベースラインを {args.baseline} に保存しました")
+
+    if args.compare:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.threshold)
+        if print_comparison(rows, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
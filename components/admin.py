@@ -1,9 +1,16 @@
 import streamlit as st
 import pandas as pd
 from pathlib import Path
-from utils.logger import setup_logger, get_logs
+from utils.config import JP_TZ
+from utils.logger import setup_logger, log_policy
+from utils.log_store import query_logs
+from utils.stats import get_deck_ids, get_summary, get_user_stats, get_question_stats
+from utils.timing import snapshot, export_spans, query_spans
 from datetime import datetime, timedelta
 
+# ログ閲覧の1ページあたりの件数
+LOG_PAGE_SIZE = 200
+
 def get_admin_logger():
     """管理者用のロガーを取得"""
     SPREADSHEET_ID = st.secrets["spreadsheet_id"]
@@ -19,13 +26,16 @@ def show_admin_screen():
     
     st.title("管理者画面 📊")
     
-    tab1, tab2 = st.tabs(["📝 ログ閲覧", "📊 統計情報"])
+    tab1, tab2, tab3 = st.tabs(["📝 ログ閲覧", "📊 統計情報", "⏱️ パフォーマンス"])
 
     with tab1:
         show_log_viewer()
     
     with tab2:
         show_statistics()
+    
+    with tab3:
+        show_performance()
 
     if st.button("クイズ画面に戻る"):
         logger.info("管理者画面からクイズ画面に戻ります")
@@ -46,15 +56,38 @@ def show_log_viewer():
             "ログレベルでフィルター",
             ["すべて", "INFO", "ERROR", "WARNING"]
         )
+    col3, col4, col5 = st.columns(3)
+    # ログは日本時間で保存しているので、日付の既定値も日本時間の今日にする
+    today = datetime.now(JP_TZ).date()
+    with col3:
+        start_date = st.date_input(
+            "開始日",
+            today - timedelta(days=7),
+            key="log_start_date"
+        )
+    with col4:
+        end_date = st.date_input("終了日", today, key="log_end_date")
+    with col5:
+        pattern_filter = st.text_input("メッセージで検索")
     
     level = None if level_filter == "すべて" else level_filter
+    filters = (user_filter, level, start_date, end_date, pattern_filter)
+    
+    # フィルターが変わったらページ位置をリセット
+    if st.session_state.get('log_viewer_filters') != filters:
+        st.session_state.log_viewer_filters = filters
+        st.session_state.log_viewer_cursors = [None]
+    cursors = st.session_state.log_viewer_cursors
+    
     try:
-        SPREADSHEET_ID = st.secrets["spreadsheet_id"]
-        logs = get_logs(
-            spreadsheet_id=SPREADSHEET_ID,
+        logs, next_cursor = query_logs(
             user_id=user_filter if user_filter else None,
             level=level,
-            limit=1000  # 表示件数制限
+            start=start_date,
+            end=end_date + timedelta(days=1),
+            pattern=pattern_filter if pattern_filter else None,
+            limit=LOG_PAGE_SIZE,
+            cursor=cursors[-1]
         )
         
         if logs:
@@ -64,14 +97,13 @@ def show_log_viewer():
             ])
             
             # タイムスタンプを日本時間に変換
-            df_logs['created_at'] = pd.to_datetime(df_logs['created_at'])
+            df_logs['created_at'] = pd.to_datetime(df_logs['created_at'], format='ISO8601')
             
-            # ログ表示
+            # ログ表示（ERRORを赤で強調）
             st.dataframe(
-                df_logs.style.highlight_cells(
-                    subset=['level'],
-                    value=['ERROR'],
-                    color='red'
+                df_logs.style.map(
+                    lambda value: 'background-color: red' if value == 'ERROR' else '',
+                    subset=['level']
                 ),
                 height=400
             )
@@ -84,6 +116,18 @@ def show_log_viewer():
                 file_name=f"quiz_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                 mime="text/csv"
             )
+            
+            # ページ送り
+            st.caption(f"{len(cursors)} ページ目")
+            prev_col, next_col = st.columns(2)
+            with prev_col:
+                if len(cursors) > 1 and st.button("⬅️ 新しいログ"):
+                    cursors.pop()
+                    st.rerun()
+            with next_col:
+                if next_cursor is not None and st.button("古いログ ➡️"):
+                    cursors.append(next_cursor)
+                    st.rerun()
         else:
             st.info("表示するログがありません")
             
@@ -98,41 +142,29 @@ def show_statistics():
     
     # 期間指定
     col1, col2 = st.columns(2)
+    # 集計は日本時間の日付単位なので、既定値も日本時間の今日にする
+    today = datetime.now(JP_TZ).date()
     with col1:
         start_date = st.date_input(
             "開始日",
-            datetime.now().date() - timedelta(days=7)
+            today - timedelta(days=7)
         )
     with col2:
-        end_date = st.date_input("終了日", datetime.now().date())
+        end_date = st.date_input("終了日", today)
     
     try:
-        SPREADSHEET_ID = st.secrets["spreadsheet_id"]
-        logs = get_logs(
-            spreadsheet_id=SPREADSHEET_ID,
-            limit=1000
+        # デッキ別に絞り込む（問題番号はデッキごとの番号）
+        deck_options = [None] + get_deck_ids(start_date, end_date)
+        deck_id = st.selectbox(
+            "デッキ",
+            deck_options,
+            format_func=lambda deck: "すべて" if deck is None else (deck or "（不明）")
         )
+
+        total_answers, correct_answers = get_summary(start_date, end_date, deck_id)
         
-        if logs:
-            # ログデータをDataFrameに変換
-            df_logs = pd.DataFrame(logs, columns=[
-                'created_at', 'user_id', 'level', 'logger_name', 'message', 'extra_data'
-            ])
-            
-            # タイムスタンプを変換
-            df_logs['created_at'] = pd.to_datetime(df_logs['created_at'])
-            
-            # 期間でフィルタリング
-            mask = (df_logs['created_at'].dt.date >= start_date) & (df_logs['created_at'].dt.date <= end_date)
-            df_filtered = df_logs[mask]
-            
-            # クイズ関連のログのみを抽出
-            df_quiz = df_filtered[df_filtered['message'].str.contains('正解|不正解', na=False)]
-            
-            # 基本統計の計算
-            total_answers = len(df_quiz)
-            correct_answers = len(df_quiz[df_quiz['message'].str.contains('正解', na=False)])
-            accuracy = (correct_answers / total_answers * 100) if total_answers > 0 else 0
+        if total_answers > 0:
+            accuracy = correct_answers / total_answers * 100
             
             # 統計情報の表示
             col1, col2, col3 = st.columns(3)
@@ -145,15 +177,90 @@ def show_statistics():
             
             # ユーザー別の統計
             st.subheader("ユーザー別統計")
-            user_stats = df_quiz.groupby('user_id').agg({
-                'message': 'count'
-            }).rename(columns={'message': '回答数'})
+            user_stats = pd.DataFrame(
+                get_user_stats(start_date, end_date, deck_id),
+                columns=['user_id', '回答数', '正解数']
+            ).set_index('user_id')
+            user_stats['正答率'] = (user_stats['正解数'] / user_stats['回答数'] * 100).round(1)
             st.dataframe(user_stats)
             
+            # 問題別の統計
+            st.subheader("問題別統計")
+            question_stats = pd.DataFrame(
+                get_question_stats(start_date, end_date, deck_id),
+                columns=['デッキ', '問題番号', '回答数', '正解数']
+            ).set_index(['デッキ', '問題番号'])
+            question_stats['正答率'] = (question_stats['正解数'] / question_stats['回答数'] * 100).round(1)
+            st.dataframe(question_stats)
+            
             logger.info(f"統計情報を表示しました（期間：{start_date}～{end_date}）")
         else:
             st.info("表示するデータがありません")
             
     except Exception as e:
         logger.error(f"統計情報の集計に失敗: {str(e)}")
-        st.error(f"統計情報の集計に失敗しました: {str(e)}")
\ No newline at end of file
+        st.error(f"統計情報の集計に失敗しました: {str(e)}")
+
+def spans_to_frame(spans):
+    """計測結果の辞書を表示用のDataFrameに変換"""
+    df_spans = pd.DataFrame.from_dict(spans, orient='index')
+    df_spans.index.name = '処理'
+    df_spans = df_spans.rename(columns={
+        'count': '回数',
+        'mean_ms': '平均(ms)',
+        'p50_ms': 'p50(ms)',
+        'p95_ms': 'p95(ms)',
+        'p99_ms': 'p99(ms)',
+        'max_ms': '最大(ms)'
+    })
+    return df_spans.round(1)
+
+def show_performance():
+    """処理時間の計測結果の表示"""
+    logger = get_admin_logger()
+    st.header("パフォーマンス")
+    
+    # 期間指定
+    col1, col2 = st.columns(2)
+    # 計測結果は日本時間で保存しているので、既定値も日本時間の今日にする
+    today = datetime.now(JP_TZ).date()
+    with col1:
+        start_date = st.date_input(
+            "開始日",
+            today - timedelta(days=1),
+            key="perf_start_date"
+        )
+    with col2:
+        end_date = st.date_input("終了日", today, key="perf_end_date")
+    
+    if st.button("このプロセスの計測結果を書き出す"):
+        export_spans()
+    
+    try:
+        spans = query_spans(start=start_date, end=end_date + timedelta(days=1))
+        
+        st.subheader("処理時間（全プロセス）")
+        if spans:
+            st.dataframe(spans_to_frame(spans))
+        else:
+            st.info("表示するデータがありません")
+        
+        # まだ書き出していない分も含めた、このプロセスの起動以降の計測結果
+        st.subheader("処理時間（このプロセス）")
+        current = snapshot()
+        if current:
+            st.dataframe(spans_to_frame(current))
+        else:
+            st.info("表示するデータがありません")
+
+        # ログポリシーで出力しなかったログの件数（このプロセスの起動以降）
+        st.subheader("抑制したログ（このプロセス）")
+        suppressed = log_policy.stats()
+        cols = st.columns(len(suppressed))
+        labels = {'dedup': "重複", 'sampled': "サンプリング", 'rate_limited': "レート制限"}
+        for col, (reason, count) in zip(cols, suppressed.items()):
+            col.metric(labels[reason], count)
+            
+    except Exception as e:
+        logger.error(f"計測結果の読み込みに失敗: {str(e)}")
+        st.error(f"計測結果の読み込みに失敗しました: {str(e)}")
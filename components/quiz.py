@@ -1,12 +1,27 @@
 import streamlit as st
 import streamlit.components.v1 as components
-from utils.gpt import evaluate_answer_with_gpt
+from utils.gpt import stream_evaluation, parse_evaluation
+from utils.grading import ANSWER_KEY_COLUMN, grade_answer
 from utils.logger import setup_logger
-import asyncio
+from utils.events import AnswerEvent, emit_answer_event
+from utils.scheduler import QuestionScheduler, seed_from, error_rate_weights
+from utils.adaptive import create_adaptive_scheduler
+from utils.quiz_state import QuizState
+from utils.session_store import get_session_store
+from utils.timing import timed, record
+from utils.stats import get_question_stats
+from utils.config import ADAPTIVE_SELECTION, WEIGHT_STATS_DAYS, JP_TZ
+from datetime import datetime, timedelta
+import re
+import time
 
 # 問題数の制限を定数として定義
 MAX_QUESTIONS = 20
 
+# GPT出力の正誤判定行
+RESULT_PATTERN = re.compile(r"RESULT:\[(CORRECT|INCORRECT)\]")
+
+@timed('show_quiz_screen')
 def show_quiz_screen(df, logger=None):
     """クイズ画面を表示する関数"""
     if logger is None:
@@ -14,60 +29,72 @@ def show_quiz_screen(df, logger=None):
           
     st.title("🗽海外旅行の基礎知識Check🏝️")
 
-    # セッション状態の初期化
-    if 'answered_questions' not in st.session_state:
-        st.session_state.answered_questions = set()
-    if 'correct_answers' not in st.session_state:
-        st.session_state.correct_answers = {}
-    if 'answers_history' not in st.session_state:
-        st.session_state.answers_history = {}
-    if 'total_attempted' not in st.session_state:
-        st.session_state.total_attempted = 0
+    # 出題順はセッション開始時に決め、以降はカーソルを進めるだけ
+    scheduler = st.session_state.get('scheduler')
+    if scheduler is None or len(scheduler) != len(df):
+        # 回答状況は問題の位置で持つので、デッキが変わったら作り直す
+        quiz_state = st.session_state.get('quiz_state')
+        resuming = quiz_state is not None and quiz_state.size == len(df)
+        if not resuming:
+            quiz_state = QuizState(len(df))
+            st.session_state.quiz_state = quiz_state
+        seed = seed_from(st.session_state.get('session_id', st.session_state.nickname))
+        if ADAPTIVE_SELECTION:
+            scheduler = create_adaptive_scheduler(
+                st.session_state.get('deck_id'),
+                df.index.tolist(),
+                st.session_state.nickname,
+                quiz_state,
+                seed=seed
+            )
+        else:
+            question_ids = df.index.tolist()
+            scheduler = QuestionScheduler(
+                question_ids, seed=seed, weights=question_weights(question_ids)
+            )
+        if resuming:
+            # 復元した途中経過の続きから出題する
+            scheduler.resume(
+                [(df.index[position], is_correct) for position, _, is_correct in quiz_state.history()],
+                st.session_state.get('question_index')
+            )
+        st.session_state.scheduler = scheduler
+        st.session_state.question_index = scheduler.current()
+    
+    quiz_state = st.session_state.quiz_state
+    # 問題数がMAX_QUESTIONSより少ないデッキは全問で終了
+    total_questions = quiz_length(df)
     
     # 終了条件のチェック（total_attemptedベース）
-    if st.session_state.total_attempted >= MAX_QUESTIONS:
-        logger.info(f"ユーザー[{st.session_state.nickname}] - {MAX_QUESTIONS}問完了")
-        st.session_state.quiz_results = {
-            'total_questions': MAX_QUESTIONS,
-            'correct_count': sum(1 for v in st.session_state.correct_answers.values() if v),
-            'answers_history': st.session_state.answers_history
-        }
-        st.session_state.screen = 'result'
-        st.rerun()
+    if quiz_state.total_attempted >= total_questions:
+        logger.info(f"ユーザー[{st.session_state.nickname}] - {total_questions}問完了")
+        finish_quiz()
         return
 
-    current_progress = st.session_state.total_attempted
-    st.progress(current_progress / MAX_QUESTIONS)
-    st.write(f"## 問題 {current_progress + 1} / {MAX_QUESTIONS}")
+    current_progress = quiz_state.total_attempted
+    st.progress(current_progress / total_questions)
+    st.write(f"## 問題 {current_progress + 1} / {total_questions}")
     current_question = st.session_state.question_index
     
-    # 20問完了時の処理
-    if current_question >= MAX_QUESTIONS:
-        logger.info(f"ユーザー[{st.session_state.nickname}] - {MAX_QUESTIONS}問完了")
-        # 結果データの保存
-        st.session_state.quiz_results = {
-            'total_questions': MAX_QUESTIONS,
-            'correct_count': sum(1 for v in st.session_state.correct_answers.values() if v),
-            'answers_history': st.session_state.answers_history
-        }
-        st.session_state.screen = 'result'
-        st.rerun()
-        return
-    
-    # 既に回答済みの問題をスキップ
-    if current_question in st.session_state.answered_questions:
-        st.session_state.question_index += 1
-        if st.session_state.total_attempted >= MAX_QUESTIONS:
-            st.session_state.screen = 'result'
-        st.rerun()
+    # 既に回答済みの問題なら次の問題へ（再実行せずにそのまま表示）
+    if is_answered(df, current_question):
+        current_question = advance_question()
+    if current_question is None:
+        # 出題できる問題がもうない
+        finish_quiz()
         return
     
     # 問題の表示
     s_selected = df.loc[current_question]
     question = s_selected.loc['質問']
     options = [s_selected.loc[f'選択肢{opt}'] for opt in ['A', 'B', 'C']]
+    correct_answer = s_selected.get(ANSWER_KEY_COLUMN)
 
-    logger.info(f"ユーザー[{st.session_state.nickname}] - 問題表示 - 問題番号: {current_question + 1}, 問題: {question}")
+    # 再実行のたびに同じ問題の表示ログが出るので、問題ごとに1回にまとめる
+    logger.info(
+        f"ユーザー[{st.session_state.nickname}] - 問題表示 - 問題番号: {current_question + 1}, 問題: {question}",
+        extra={'log_key': f'問題表示:{current_question}'}
+    )
 
     st.markdown(f'## {question}')
 
@@ -78,9 +105,64 @@ def show_quiz_screen(df, logger=None):
             st.warning('回答を選択してください。')
             return
         
-        handle_answer(select_button, question, options, current_question, logger)
+        handle_answer(
+            select_button, question, options, current_question, logger, correct_answer,
+            position=df.index.get_loc(current_question)
+        )
+
+    show_navigation_buttons(df, current_question, logger)
+
+def quiz_length(df):
+    """1回のクイズの問題数"""
+    return min(MAX_QUESTIONS, len(df))
+
+def finish_quiz():
+    """スコアを確定して結果画面へ移る"""
+    quiz_state = st.session_state.quiz_state
+    st.session_state.quiz_results = {
+        'total_questions': quiz_state.total_attempted,
+        'correct_count': quiz_state.correct_count
+    }
+    st.session_state.screen = 'result'
+    st.rerun()
+
+def question_weights(question_ids):
+    """直近の問題別統計から誤答率ベースの出題の重みを作成（取得できなければNone）"""
+    end_date = datetime.now(JP_TZ).date()
+    start_date = end_date - timedelta(days=WEIGHT_STATS_DAYS)
+    try:
+        rows = get_question_stats(start_date, end_date, st.session_state.get('deck_id') or '')
+    except Exception as e:
+        print(f"問題別統計の取得に失敗: {str(e)}")
+        return None
+    # (deck_id, question_id, 回答数, 正解数) からデッキの列を除く
+    return error_rate_weights(question_ids, [row[1:] for row in rows])
 
-    show_navigation_buttons(current_question, logger)
+def is_answered(df, question_id):
+    """問題が回答済みか（出題する問題がない場合はFalse）"""
+    if question_id is None:
+        return False
+    return st.session_state.quiz_state.is_answered(df.index.get_loc(question_id))
+
+def advance_question():
+    """スケジューラを1つ進め、新しい問題番号を返す"""
+    next_question = st.session_state.scheduler.advance()
+    st.session_state.question_index = next_question
+    save_progress()
+    return next_question
+
+def save_progress():
+    """途中経過を保存（書き込みはバックグラウンドでまとめて行われる）"""
+    try:
+        get_session_store().save(
+            st.session_state.nickname,
+            st.session_state.get('deck_id'),
+            st.session_state.get('session_id', ''),
+            st.session_state.quiz_state,
+            st.session_state.question_index
+        )
+    except Exception as e:
+        print(f"途中経過の保存に失敗: {str(e)}")
 
 def show_answer_animation(is_correct):
     """洗練された回答アニメーション表示"""
@@ -162,36 +244,39 @@ def show_answer_animation(is_correct):
             </div>
         """, unsafe_allow_html=True)
 
-def process_answer(is_correct, current_question, select_button, gpt_response, logger):
-    """回答処理と表示"""
-    # まず回答の正誤を処理
-    if current_question not in st.session_state.answered_questions:
+def record_answer(is_correct, current_question, select_button, logger, evaluator_latency_ms=None, position=None, choice=None):
+    """回答結果を記録して保存（同じ問題への2回目以降の回答は無視）"""
+    quiz_state = st.session_state.quiz_state
+    if position is not None and not quiz_state.is_answered(position):
         if is_correct:
-            logger.info(f"ユーザー[{st.session_state.nickname}] - 正解 - 問題番号: {st.session_state.total_attempted + 1}, ユーザー回答: {select_button}")
+            logger.info(f"ユーザー[{st.session_state.nickname}] - 正解 - 問題番号: {quiz_state.total_attempted + 1}, ユーザー回答: {select_button}")
         else:
-            logger.info(f"ユーザー[{st.session_state.nickname}] - 不正解 - 問題番号: {st.session_state.total_attempted + 1}, ユーザー回答: {select_button}")
+            logger.info(f"ユーザー[{st.session_state.nickname}] - 不正解 - 問題番号: {quiz_state.total_attempted + 1}, ユーザー回答: {select_button}")
         
-        # 回答済みとしてマークする前にカウントを増やす
-        st.session_state.total_attempted += 1
-        st.session_state.answered_questions.add(current_question)
-    
+        # 回答イベントの保存（統計の集計にも反映される）
+        try:
+            emit_answer_event(AnswerEvent(
+                session_id=st.session_state.get('session_id', ''),
+                user_id=st.session_state.nickname,
+                question_id=current_question,
+                chosen_option=select_button,
+                is_correct=is_correct,
+                evaluator_latency_ms=evaluator_latency_ms,
+                deck_id=st.session_state.get('deck_id')
+            ))
+        except Exception as e:
+            logger.error(f"回答イベントの保存に失敗: {str(e)}")
+        
+        # 回答済みとしてマーク（件数もここで増える）
+        quiz_state.record(position, choice, is_correct)
+        st.session_state.scheduler.record(current_question, is_correct)
+        save_progress()
+
+def show_evaluation(select_button, gpt_response, logger, known_answer=None):
+    """評価結果（回答・正解・解説）の表示"""
     try:
         # GPTレスポンスから情報を抽出
-        response_lines = [line.strip() for line in gpt_response.split('\n') if line.strip()]
-        
-        # デフォルト値を設定
-        user_answer = select_button
-        correct_answer = "解答の取得に失敗しました"
-        explanation = "解説の取得に失敗しました"
-        
-        # 各行を解析
-        for line in response_lines:
-            if line.startswith("あなたの回答:"):
-                user_answer = line.replace("あなたの回答:", "").strip()
-            elif line.startswith("正解:"):
-                correct_answer = line.replace("正解:", "").strip()
-            elif line.startswith("解説:"):
-                explanation = line.replace("解説:", "").strip()
+        user_answer, correct_answer, explanation = parse_evaluation(gpt_response, select_button, known_answer)
 
         # スタイルを1行で定義
         style = """<style>.explanation-box{border:1px solid #e0e0e0;border-radius:8px;padding:16px;margin-top:12px;background-color:#f8f9fa;}.answer-detail{display:flex;align-items:center;margin:8px 0;font-size:15px;}.answer-label{min-width:100px;font-weight:600;color:#555;}.explanation-text{margin-top:12px;padding-top:12px;border-top:1px solid #e0e0e0;line-height:1.6;color:#333;}</style>"""
@@ -222,26 +307,57 @@ def process_answer(is_correct, current_question, select_button, gpt_response, lo
         # エラー時は元のテキスト表示にフォールバック
         st.write(gpt_response.replace("RESULT:[CORRECT]", "").replace("RESULT:[INCORRECT]", "").strip())
 
-def handle_answer(select_button, question, options, current_question, logger):
+def handle_answer(select_button, question, options, current_question, logger, correct_answer=None, position=None):
     """回答ハンドリング処理"""
-    with st.spinner('GPT-4が回答を評価しています...'):
-        gpt_response = asyncio.run(evaluate_answer_with_gpt(question, options, select_button))
+    choice = options.index(select_button)
+    # 正解データがあればローカルで即座に採点
+    is_correct = grade_answer(correct_answer, select_button)
+    if is_correct is not None:
+        show_answer_animation(is_correct)
+        # 解説を待つ間に再実行されても回答が失われないよう、先に保存する
+        record_answer(is_correct, current_question, select_button, logger, position=position, choice=choice)
+    else:
+        correct_answer = None
     
-    is_correct = "RESULT:[CORRECT]" in gpt_response
+    # GPTは解説の生成に使用（正解データがない場合のみ採点にも使用）
+    # 出力はストリーミングで受け取り、届いた分から表示する
+    spinner_text = '解説を生成しています...' if is_correct is not None else 'GPT-4が回答を評価しています...'
+    verdict_placeholder = st.empty()
+    stream_placeholder = st.empty()
+    chunks = []
+    with st.spinner(spinner_text):
+        started_at = time.perf_counter()
+        for chunk in stream_evaluation(question, options, select_button, correct_answer):
+            chunks.append(chunk)
+            partial = ''.join(chunks)
+            
+            # RESULT行が届いた時点で正誤を表示
+            verdict = RESULT_PATTERN.search(partial) if is_correct is None else None
+            if verdict:
+                is_correct = verdict.group(1) == "CORRECT"
+                with verdict_placeholder.container():
+                    show_answer_animation(is_correct)
+            
+            stream_placeholder.markdown(
+                partial.replace("RESULT:[CORRECT]", "").replace("RESULT:[INCORRECT]", "").strip()
+            )
+        evaluator_latency_ms = (time.perf_counter() - started_at) * 1000
+    record('stream_evaluation', evaluator_latency_ms)
+    stream_placeholder.empty()
+    gpt_response = ''.join(chunks)
     
-    # 回答結果の保存
-    st.session_state.correct_answers[current_question] = is_correct
-    st.session_state.answers_history[current_question] = {
-        'question': question,
-        'user_answer': select_button,
-        'is_correct': is_correct,
-        'explanation': gpt_response.replace("RESULT:[CORRECT]", "").replace("RESULT:[INCORRECT]", "").strip()
-    }
+    if is_correct is None:
+        is_correct = "RESULT:[CORRECT]" in gpt_response
+        show_answer_animation(is_correct)
     
-    show_answer_animation(is_correct)
-    process_answer(is_correct, current_question, select_button, gpt_response, logger)
+    # GPTで採点した場合はここで保存（解説は評価キャッシュにあるのでセッションには持たない）
+    record_answer(
+        is_correct, current_question, select_button, logger,
+        evaluator_latency_ms, position=position, choice=choice
+    )
+    show_evaluation(select_button, gpt_response, logger, correct_answer)
 
-def show_navigation_buttons(current_question, logger):
+def show_navigation_buttons(df, current_question, logger):
     """ナビゲーションボタンの表示"""
     # 解説との間にスペースを追加
     st.markdown("<div style='margin-top: 40px;'></div>", unsafe_allow_html=True)
@@ -249,24 +365,22 @@ def show_navigation_buttons(current_question, logger):
     col1, col2, col3 = st.columns([1, 2, 1])
     
     with col2:
-        if st.session_state.total_attempted >= MAX_QUESTIONS:
+        total_questions = quiz_length(df)
+        if st.session_state.quiz_state.total_attempted >= total_questions:
             if st.button('結果を見る🎖️', 
                         use_container_width=True, 
                         type="primary",  # 結果確認は重要なアクションなのでprimary
                         help="クイズが完了しました。結果を確認しましょう"):
-                logger.info(f"ユーザー[{st.session_state.nickname}] - {MAX_QUESTIONS}問完了 - 結果画面へ遷移")
-                st.session_state.screen = 'result'
-                st.rerun()
-        elif current_question in st.session_state.answered_questions:
+                logger.info(f"ユーザー[{st.session_state.nickname}] - {total_questions}問完了 - 結果画面へ遷移")
+                finish_quiz()
+        elif is_answered(df, current_question):
             if st.button('次の問題へ ➡️', 
                         use_container_width=True,
                         type="secondary",  # 次へは控えめにsecondary
                         help="次の問題に進みます"):
-                logger.info(f"ユーザー[{st.session_state.nickname}] - 次の問題へ進む - 現在の問題番号: {st.session_state.total_attempted + 1}")
-                next_question = current_question
-                while next_question in st.session_state.answered_questions:
-                    next_question = (next_question + 1) % len(df)
-                st.session_state.question_index = next_question
+                logger.info(f"ユーザー[{st.session_state.nickname}] - 次の問題へ進む - 現在の問題番号: {st.session_state.quiz_state.total_attempted + 1}")
+                if advance_question() is None:
+                    finish_quiz()
                 st.rerun()
     
     # フッターのような余白を追加
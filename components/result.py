@@ -1,20 +1,33 @@
 import streamlit as st
+import uuid
 from utils.logger import logger
+from utils.gpt import lookup_evaluation
+from utils.grading import OPTION_COLUMNS, ANSWER_KEY_COLUMN, grade_answer
+from utils.session_store import get_session_store
 
 def show_result_screen(df):
     st.title("🙌クイズ完了")
     
-    # quiz_resultsからスコア情報を取得
-    if 'quiz_results' not in st.session_state:
-        logger.error("quiz_resultsが見つかりません")
-        return
-        
-    results = st.session_state.quiz_results
-    total_questions = results['total_questions']  # MAX_QUESTIONS(3)と同じ
+    # quiz_resultsからスコア情報を取得（ない場合は回答状況から求める）
+    results = st.session_state.get('quiz_results')
+    quiz_state = st.session_state.get('quiz_state')
+    if results is None:
+        if quiz_state is None:
+            logger.error("quiz_resultsが見つかりません")
+            st.warning("結果が見つかりませんでした。")
+            if st.button("もう一度チャレンジ"):
+                reset_session_state()
+                st.rerun()
+            return
+        results = {
+            'total_questions': quiz_state.total_attempted,
+            'correct_count': quiz_state.correct_count
+        }
+    total_questions = results['total_questions']
     correct_count = results['correct_count']
     
     # 正答率の計算
-    accuracy = (correct_count / total_questions) * 100
+    accuracy = (correct_count / total_questions) * 100 if total_questions else 0.0
     
     logger.info(f"クイズ完了 - 正解数: {correct_count}/ {total_questions} , 正答率: {accuracy:.1f}%")
     
@@ -24,14 +37,10 @@ def show_result_screen(df):
     st.markdown(f"### 正答率: {accuracy:.1f}%")
     
     # 回答履歴の表示（オプション）
-    if 'answers_history' in results:
+    if quiz_state is not None and quiz_state.total_attempted:
         st.markdown("## 回答履歴")
-        for q_idx, answer_data in results['answers_history'].items():
-            with st.expander(f"問題 {q_idx + 1}: {answer_data['question']}"):
-                st.write(f"あなたの回答: {answer_data['user_answer']}")
-                st.write(f"結果: {'✅ 正解' if answer_data['is_correct'] else '❌ 不正解'}")
-                st.write("解説:")
-                st.write(answer_data['explanation'])
+        for position, choice, is_correct in quiz_state.history():
+            show_answer_detail(df, position, choice, is_correct)
     
     # 成績に応じたメッセージ
     if accuracy == 100:
@@ -48,19 +57,43 @@ def show_result_screen(df):
         reset_session_state()
         st.rerun()
 
+def show_answer_detail(df, position, choice, is_correct):
+    """1問分の回答履歴を表示（文字列は問題データと評価キャッシュから取得）"""
+    row = df.iloc[position]
+    question = row['質問']
+    options = [row[column] for column in OPTION_COLUMNS.values()]
+    user_answer = options[choice]
+    correct_answer = row.get(ANSWER_KEY_COLUMN)
+    if grade_answer(correct_answer, user_answer) is None:
+        correct_answer = None
+
+    with st.expander(f"問題 {df.index[position] + 1}: {question}"):
+        st.write(f"あなたの回答: {user_answer}")
+        st.write(f"結果: {'✅ 正解' if is_correct else '❌ 不正解'}")
+        st.write("解説:")
+        explanation = lookup_evaluation(question, options, user_answer, correct_answer)
+        if explanation is None:
+            st.write("解説を取得できませんでした")
+        else:
+            st.write(explanation.replace("RESULT:[CORRECT]", "").replace("RESULT:[INCORRECT]", "").strip())
+
 def reset_session_state():
     """クイズの状態を初期化"""
     logger.info("クイズを再スタート")
     
+    # 保存済みの途中経過も破棄して最初から始める
+    if st.session_state.get('nickname'):
+        get_session_store().discard(st.session_state.nickname, st.session_state.get('deck_id'))
+    
     # 初期化が必要な全てのセッション状態をリセット
     keys_to_reset = {
         'screen': 'quiz',
         'question_index': 0,
-        'total_attempted': 0,
-        'answered_questions': set(),
-        'correct_answers': {},
-        'answers_history': {},
-        'quiz_results': None
+        'quiz_state': None,
+        'quiz_results': None,
+        'scheduler': None,
+        # やり直しは別のセッションとして記録し、出題順のシードも変える
+        'session_id': uuid.uuid4().hex
     }
     
     for key, value in keys_to_reset.items():
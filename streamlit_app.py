@@ -1,8 +1,11 @@
 import streamlit as st
-import pandas as pd
+import uuid
 from components.quiz import show_quiz_screen
 from components.result import show_result_screen
-from utils.logger import setup_logger
+from utils.logger import setup_logger, set_current_user
+from utils.deck_registry import DEFAULT_DECK_ID, get_registry
+from utils.session_store import get_session_store
+from utils.timing import span, timed
 
 def init_session_state():
     """セッション状態の初期化"""
@@ -12,15 +15,20 @@ def init_session_state():
         st.session_state.question_index = 0
     if 'correct_count' not in st.session_state:
         st.session_state.correct_count = 0
-    if 'total_attempted' not in st.session_state:
-        st.session_state.total_attempted = 0
+    if 'quiz_state' not in st.session_state:
+        st.session_state.quiz_state = None
     if 'nickname' not in st.session_state:
         st.session_state.nickname = None
     if 'logger' not in st.session_state:
         st.session_state.logger = None
     if 'quiz_df' not in st.session_state:
         st.session_state.quiz_df = None
+    if 'deck_id' not in st.session_state:
+        st.session_state.deck_id = DEFAULT_DECK_ID
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
 
+@timed('init_logger')
 def init_logger():
     """ロガーの初期化と設定"""
     try:
@@ -42,12 +50,11 @@ def init_logger():
         st.error(f"ロガーの初期化に失敗しました: {str(e)}")
         return False
 
-@st.cache_data
-def load_data():
-    """データの読み込み"""
+@timed('load_data')
+def load_data(deck_id=None):
+    """データの読み込み（読み込み済みのデッキはプロセス内で共有）"""
     try:
-        df = pd.read_excel('f_kaigai.xlsx', sheet_name='sheet1', index_col=0)
-        return df
+        return get_registry().get_deck(deck_id or st.session_state.get('deck_id') or DEFAULT_DECK_ID)
     except Exception as e:
         st.error("データの読み込みに失敗しました。")
         return None
@@ -63,16 +70,52 @@ def show_sidebar():
                 st.session_state.quiz_df = None
                 st.rerun()
 
+def restore_session(nickname, deck_id):
+    """保存済みの途中経過があれば復元する（なければ新しく始める）"""
+    saved = None
+    try:
+        saved = get_session_store().load(nickname, deck_id)
+    except Exception as e:
+        print(f"途中経過の読み込みに失敗: {str(e)}")
+
+    st.session_state.scheduler = None
+    st.session_state.quiz_results = None
+    if saved is None:
+        # 前にログインしていたユーザーのセッションIDを引き継がない
+        st.session_state.session_id = uuid.uuid4().hex
+        st.session_state.quiz_state = None
+        st.session_state.question_index = 0
+        return False
+
+    session_id, quiz_state, question_id = saved
+    st.session_state.session_id = session_id
+    st.session_state.quiz_state = quiz_state
+    st.session_state.question_index = question_id
+    return True
+
 def show_login_screen():
     """ログイン画面の表示"""
     st.title("ログイン")
+    decks = get_registry().list_decks()
     with st.form("login_form"):
         nickname = st.text_input("ニックネームを入力してください")
+        deck_id = st.session_state.deck_id
+        if len(decks) > 1:
+            deck_ids = [deck.deck_id for deck in decks]
+            titles = {deck.deck_id: deck.title for deck in decks}
+            deck_id = st.selectbox(
+                "問題デッキを選択してください",
+                deck_ids,
+                index=deck_ids.index(deck_id) if deck_id in deck_ids else 0,
+                format_func=titles.get
+            )
         submitted = st.form_submit_button("開始")
         
         if submitted and nickname:
             st.session_state.nickname = nickname
+            st.session_state.deck_id = deck_id
             st.session_state.screen = 'quiz'
+            restore_session(nickname, deck_id)
             
             if init_logger():
                 st.rerun()
@@ -80,8 +123,13 @@ def show_login_screen():
                 st.error("ログインできません。システム管理者に連絡してください。")
 
 def main():
+    with span('rerun'):
+        run_app()
+
+def run_app():
     # 初期化処理
     init_session_state()
+    set_current_user(st.session_state.nickname)
     
     # サイドバーの表示
     show_sidebar()
@@ -0,0 +1,231 @@
+"""回答履歴にもとづく適応的な出題
+
+問題ごとの難易度は全ユーザーの回答結果から1PL（Rasch）モデルの
+考え方で推定し、バックグラウンドで新しい回答イベントだけを取り込んで
+更新する。ユーザーの能力はセッション中の正誤から推定し、正答確率が
+50%に近い（情報量が大きい）問題と、過去に間違えた問題を優先して出題する。
+"""
+import threading
+import numpy as np
+import pandas as pd
+from .config import LOG_DB_PATH
+from .events import fetch_outcomes_since, fetch_user_outcomes
+
+# 難易度を更新する間隔（秒）
+REFRESH_INTERVAL = 30.0
+# 回答が少ない問題・ユーザーを正答率50%に寄せるための事前分布の強さ
+PRIOR_STRENGTH = 1.0
+# 過去に間違えた問題の優先度の上げ幅
+WRONG_BOOST = 1.0
+# 同じ条件の問題がいつも同じ順にならないための揺らぎ
+JITTER = 0.05
+# 出題のたびに優先度を計算する候補の数
+CANDIDATES = 256
+
+def _logit(p):
+    return np.log(p) - np.log1p(-p)
+
+class DifficultyModel:
+    """デッキ内の問題ごとの難易度（誤答率のロジット）"""
+    def __init__(self, deck_id, question_ids, db_path=LOG_DB_PATH):
+        self.deck_id = deck_id
+        self.db_path = db_path
+        self.index = pd.Index(question_ids)
+        size = len(self.index)
+        self._lock = threading.Lock()
+        self._attempts = np.zeros(size)
+        self._correct = np.zeros(size)
+        self._last_event_id = 0
+        self.difficulty = np.zeros(size)
+
+    def positions(self, question_ids):
+        """問題IDを配列上の位置に変換（存在しなければ-1）"""
+        return self.index.get_indexer(question_ids)
+
+    def refresh(self):
+        """前回以降の回答イベントだけを取り込んで難易度を更新"""
+        with self._lock:
+            outcomes = fetch_outcomes_since(self._last_event_id, self.deck_id, self.db_path)
+            if len(outcomes) == 0:
+                return
+            positions = self.positions(outcomes[:, 1])
+            valid = positions >= 0
+            attempts = self._attempts + np.bincount(
+                positions[valid], minlength=len(self.index)
+            )
+            correct = self._correct + np.bincount(
+                positions[valid], weights=outcomes[valid, 2], minlength=len(self.index)
+            )
+            error_rate = (attempts - correct + PRIOR_STRENGTH) / (attempts + 2 * PRIOR_STRENGTH)
+
+            self._attempts = attempts
+            self._correct = correct
+            self._last_event_id = int(outcomes[-1, 0])
+            # 読み手はロックなしで参照するため、配列ごと差し替える
+            self.difficulty = _logit(error_rate)
+
+class AdaptiveScheduler:
+    """QuestionSchedulerと同じインターフェースの適応的スケジューラ
+
+    回答済みの問題はQuizStateのビット列をそのまま使い、ユーザーの過去の
+    回答は答えたことのある問題の分だけ持つ。出題のたびに未回答の問題から
+    候補を抜き出し、その候補についてだけ優先度を計算する。
+    """
+    __slots__ = (
+        'model', 'quiz_state', 'history_positions', 'history_preference',
+        'n_answered', 'n_correct', 'answered_difficulty', '_rng', '_current'
+    )
+
+    def __init__(self, model, quiz_state, user_outcomes=None, seed=None):
+        self.model = model
+        self.quiz_state = quiz_state
+        self.history_positions = np.empty(0, dtype=np.int64)
+        self.history_preference = np.empty(0)
+        if user_outcomes is not None and len(user_outcomes):
+            positions = model.positions(user_outcomes[:, 0])
+            valid = positions >= 0
+            # 答えたことのある問題だけの (位置, 正解数, 不正解数)
+            self.history_positions, inverse = np.unique(positions[valid], return_inverse=True)
+            correct = user_outcomes[valid, 1].astype(np.float64)
+            size = len(self.history_positions)
+            prior_correct = np.bincount(inverse, weights=correct, minlength=size)
+            prior_wrong = np.bincount(inverse, weights=1.0 - correct, minlength=size)
+            self.history_preference = (1.0 + WRONG_BOOST * prior_wrong) / (1.0 + prior_correct)
+        self._rng = np.random.default_rng(seed)
+        self.n_answered = 0
+        self.n_correct = 0
+        self.answered_difficulty = 0.0
+        self._current = self._select()
+
+    def __len__(self):
+        return self.quiz_state.size
+
+    @property
+    def remaining(self):
+        return self.quiz_state.size - self.quiz_state.total_attempted
+
+    def ability(self):
+        """セッション中の正誤から推定した能力（難易度と同じロジット尺度）"""
+        accuracy = (self.n_correct + PRIOR_STRENGTH) / (self.n_answered + 2 * PRIOR_STRENGTH)
+        # 解いた問題の平均難易度を基準にする
+        offset = self.answered_difficulty / self.n_answered if self.n_answered else 0.0
+        return float(_logit(accuracy)) + offset
+
+    def _unanswered(self, positions):
+        """位置の配列から、まだ回答していないものだけを返す"""
+        answered = np.frombuffer(self.quiz_state.answered, dtype=np.uint8)
+        mask = (answered[positions >> 3] >> (positions & 7)) & 1
+        return positions[mask == 0]
+
+    def _candidates(self):
+        """未回答の問題から優先度を計算する候補の位置を選ぶ"""
+        size = self.quiz_state.size
+        if self.remaining > CANDIDATES:
+            # 無作為に選んだ問題と、過去に間違えた問題を候補にする
+            sampled = self._rng.integers(0, size, CANDIDATES)
+            wrong = self.history_positions[self.history_preference > 1.0]
+            candidates = self._unanswered(np.unique(np.concatenate((sampled, wrong))))
+            if len(candidates):
+                return candidates
+        # 残りが少なければ、回答済みでないビットを含むバイトから全部拾う
+        answered = np.frombuffer(self.quiz_state.answered, dtype=np.uint8)
+        blocks = np.flatnonzero(answered != 0xFF)
+        positions = (blocks[:, None] * 8 + np.arange(8)).ravel()
+        return self._unanswered(positions[positions < size])
+
+    def _select(self):
+        """まだ出題していない問題から最もスコアの高いものの位置を返す"""
+        if self.remaining <= 0:
+            return None
+        candidates = self._candidates()
+        if not len(candidates):
+            return None
+        # 過去の回答がない問題の優先度は1、ある問題は履歴から引く
+        preference = np.ones(len(candidates))
+        if len(self.history_positions):
+            index = np.searchsorted(self.history_positions, candidates)
+            index[index == len(self.history_positions)] = 0
+            known = self.history_positions[index] == candidates
+            preference[known] = self.history_preference[index[known]]
+        # 同じ条件の問題がいつも同じ順にならないよう揺らぎを加える
+        preference *= self._rng.uniform(1 - JITTER, 1 + JITTER, len(candidates))
+        # 正答確率pに対する情報量 p(1-p) = e / (1 + e)^2 （e = exp(難易度 - 能力)）
+        e = np.exp(self.model.difficulty[candidates] - self.ability())
+        score = e / np.square(1.0 + e) * preference
+        return int(candidates[np.argmax(score)])
+
+    def current(self):
+        """現在の問題ID（出題し終えていればNone）"""
+        if self._current is None:
+            return None
+        question_id = self.model.index[self._current]
+        return question_id.item() if isinstance(question_id, np.generic) else question_id
+
+    def record(self, question_id, is_correct):
+        """回答結果を反映（能力の推定に使う。回答済みの印はQuizStateが持つ）"""
+        try:
+            position = self.model.index.get_loc(question_id)
+        except KeyError:
+            return
+        self.n_answered += 1
+        self.n_correct += 1 if is_correct else 0
+        self.answered_difficulty += float(self.model.difficulty[position])
+
+    def resume(self, history, question_id):
+        """保存した途中経過から再開（history: (問題ID, 正解か) の列）"""
+        for answered_id, is_correct in history:
+            self.record(answered_id, is_correct)
+        if question_id is not None and question_id in self.model.index:
+            position = self.model.index.get_loc(question_id)
+            if not self.quiz_state.is_answered(position):
+                self._current = position
+                return
+        self._current = self._select()
+
+    def advance(self):
+        """次の問題に進み、その問題IDを返す（なければNone）"""
+        self._current = self._select()
+        return self.current()
+
+_models = {}
+_models_lock = threading.Lock()
+_refresher = None
+
+def _refresh_loop(stop_event):
+    while not stop_event.wait(REFRESH_INTERVAL):
+        for model in list(_models.values()):
+            try:
+                model.refresh()
+            except Exception as e:
+                print(f"難易度の更新中にエラーが発生: {str(e)}")
+
+def get_difficulty_model(deck_id, question_ids, db_path=LOG_DB_PATH):
+    """デッキの難易度モデルを返す（初回は読み込み、以降はバックグラウンドで更新）"""
+    global _refresher
+
+    key = (deck_id, db_path)
+    model = _models.get(key)
+    if model is not None and model.index.equals(pd.Index(question_ids)):
+        return model
+
+    with _models_lock:
+        model = _models.get(key)
+        if model is None or not model.index.equals(pd.Index(question_ids)):
+            model = DifficultyModel(deck_id, question_ids, db_path)
+            model.refresh()
+            _models[key] = model
+        if _refresher is None:
+            _refresher = threading.Thread(
+                target=_refresh_loop,
+                args=(threading.Event(),),
+                name='DifficultyRefresher',
+                daemon=True
+            )
+            _refresher.start()
+        return model
+
+def create_adaptive_scheduler(deck_id, question_ids, user_id, quiz_state, seed=None, db_path=LOG_DB_PATH):
+    """ユーザーの回答履歴を反映した適応的スケジューラを作成"""
+    model = get_difficulty_model(deck_id, question_ids, db_path)
+    user_outcomes = fetch_user_outcomes(user_id, deck_id, db_path)
+    return AdaptiveScheduler(model, quiz_state, user_outcomes, seed)
@@ -1,9 +1,69 @@
-import streamlit as st
+from datetime import timedelta, timezone
 
-# Google Sheets関連の設定
-SPREADSHEET_ID = st.secrets["gsheet"]["spreadsheet_id"]
+# 日本時間（夏時間がないので固定オフセットで十分。pytzより変換が速い）
+JP_TZ = timezone(timedelta(hours=9), 'JST')
 
-# OpenAI関連の設定
-OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
+# シークレットはインポート時ではなく、初めて使うときに読み込む
+_SECRETS = {
+    # Google Sheets関連の設定
+    'SPREADSHEET_ID': ('gsheet', 'spreadsheet_id'),
+    # OpenAI関連の設定
+    'OPENAI_API_KEY': ('OPENAI_API_KEY',),
+}
 
-SHEET_NAME = "sheet1"
\ No newline at end of file
+def get_secret(name):
+    """Streamlitのシークレットから設定値を読み込む"""
+    import streamlit as st
+
+    value = st.secrets
+    for key in _SECRETS[name]:
+        value = value[key]
+    return value
+
+def get_spreadsheet_id():
+    return get_secret('SPREADSHEET_ID')
+
+def get_openai_api_key():
+    return get_secret('OPENAI_API_KEY')
+
+def __getattr__(name):
+    # config.SPREADSHEET_IDのような従来の参照も遅延読み込みにする
+    if name in _SECRETS:
+        return get_secret(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+SHEET_NAME = "sheet1"
+
+# ローカルログストアの設定
+LOG_DB_PATH = "logs/app_logs.db"
+
+# GPT評価キャッシュの設定
+GPT_CACHE_DB_PATH = "cache/gpt_cache.db"
+
+# 問題データと事前計算済み解説の保存先
+QUIZ_DATA_PATH = "f_kaigai.xlsx"
+EXPLANATIONS_PATH = "data/explanations.json"
+COMPILED_DATA_DIR = "data/compiled"
+
+# 問題デッキの設定（DECKS_DIR内の*.xlsxもデッキとして扱う）
+DECKS_DIR = "decks"
+MAX_LOADED_DECKS = 8
+
+# ユーザーごとのロガーを保持する上限（超えたら使われていないものから捨てる）
+MAX_USER_LOGGERS = 1024
+
+# INFO以下のログの抑制（WARNING以上は常に出力する）
+# extraにlog_keyを付けたログを、同じユーザー・同じキーにつき1回だけ出す期間（秒、0で無効）
+LOG_DEDUP_WINDOW = 300.0
+# 出力する割合（0〜1）。キーはレベル名または "ロガー名:レベル名"（例: {'DEBUG': 0.1}）
+LOG_SAMPLE_RATES = {}
+# ユーザーごとのトークンバケット（1秒あたりの件数と、まとめて出せる件数。0で無効）
+LOG_RATE_PER_USER = 1.0
+LOG_BURST_PER_USER = 30
+# 重複の判定とトークンバケットで保持するキーの上限
+LOG_POLICY_MAX_KEYS = 10000
+
+# 回答履歴にもとづく適応的な出題を行うか（Falseなら誤答率で重み付けした順番）
+ADAPTIVE_SELECTION = True
+# 出題順の重み付けに使う問題別統計の期間（日）
+WEIGHT_STATS_DAYS = 30
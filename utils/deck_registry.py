@@ -0,0 +1,147 @@
+"""複数の問題デッキ（ワークブック×シート）を管理するレジストリ
+
+デッキの一覧はワークブックのシート名だけを読んで作成し、問題データは
+初めて使われたときに読み込む。読み込み済みのデッキは件数上限付きの
+LRUで保持し、ファイルが更新されていれば次のアクセス時に読み直す。
+"""
+import os
+import glob
+import zipfile
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from dataclasses import dataclass
+from .config import QUIZ_DATA_PATH, SHEET_NAME, DECKS_DIR, MAX_LOADED_DECKS
+from .question_bank import load_question_bank, source_key
+
+_SPREADSHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+@dataclass(frozen=True)
+class DeckInfo:
+    """デッキのメタデータ（問題データは含まない）"""
+    deck_id: str
+    title: str
+    path: str
+    sheet_name: str
+
+def deck_id_for(path, sheet_name):
+    """ワークブックのパスとシート名からデッキIDを作成
+
+    別のディレクトリにある同名のワークブックと衝突しないよう、
+    解決済みパスのハッシュを含める。
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f'{stem}-{source_key(path)}/{sheet_name}'
+
+DEFAULT_DECK_ID = deck_id_for(QUIZ_DATA_PATH, SHEET_NAME)
+
+def list_sheet_names(path):
+    """ワークブック全体を読み込まずにシート名の一覧を取得"""
+    with zipfile.ZipFile(path) as archive:
+        root = ET.fromstring(archive.read('xl/workbook.xml'))
+    return [sheet.get('name') for sheet in root.iter(f'{_SPREADSHEET_NS}sheet')]
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+class DeckRegistry:
+    """デッキの索引と読み込み済みデッキのLRUキャッシュ"""
+    def __init__(self, sources=None, decks_dir=DECKS_DIR, max_loaded=MAX_LOADED_DECKS):
+        self.sources = list(sources) if sources is not None else [QUIZ_DATA_PATH]
+        self.decks_dir = decks_dir
+        self.max_loaded = max_loaded
+        self._lock = threading.Lock()
+        self._index = {}
+        self._index_mtimes = None
+        self._loaded = OrderedDict()
+        # デッキごとの読み込みロック（同じデッキを同時に何度も読み込まない）
+        self._load_locks = {}
+
+    def _workbook_paths(self):
+        paths = [path for path in self.sources if os.path.exists(path)]
+        if self.decks_dir and os.path.isdir(self.decks_dir):
+            paths.extend(sorted(glob.glob(os.path.join(self.decks_dir, '*.xlsx'))))
+        return paths
+
+    def _refresh_index(self):
+        """ワークブックの追加・更新があれば索引を作り直す"""
+        paths = self._workbook_paths()
+        mtimes = {path: _mtime(path) for path in paths}
+        if self.decks_dir:
+            mtimes[self.decks_dir] = _mtime(self.decks_dir)
+        if mtimes == self._index_mtimes:
+            return
+
+        index = {}
+        for path in paths:
+            try:
+                sheet_names = list_sheet_names(path)
+            except (OSError, KeyError, zipfile.BadZipFile, ET.ParseError) as e:
+                print(f"ワークブックの読み込みに失敗: {path}: {str(e)}")
+                continue
+            stem = os.path.splitext(os.path.basename(path))[0]
+            for sheet_name in sheet_names:
+                deck_id = deck_id_for(path, sheet_name)
+                index[deck_id] = DeckInfo(deck_id, f'{stem} / {sheet_name}', path, sheet_name)
+        self._index = index
+        self._index_mtimes = mtimes
+
+    def list_decks(self):
+        """利用可能なデッキのメタデータ一覧"""
+        with self._lock:
+            self._refresh_index()
+            return list(self._index.values())
+
+    def _cached(self, deck_id, mtime):
+        """読み込み済みで更新されていなければ問題データを返す（ロック内で呼ぶ）"""
+        entry = self._loaded.get(deck_id)
+        if entry is not None and entry[0] == mtime:
+            self._loaded.move_to_end(deck_id)
+            return entry[1]
+        return None
+
+    def get_deck(self, deck_id=DEFAULT_DECK_ID):
+        """デッキの問題データを返す（必要なら読み込み・再読み込み）"""
+        with self._lock:
+            self._refresh_index()
+            info = self._index.get(deck_id)
+            if info is None:
+                raise KeyError(f"デッキが見つかりません: {deck_id}")
+
+            mtime = _mtime(info.path)
+            df = self._cached(deck_id, mtime)
+            if df is not None:
+                return df
+            load_lock = self._load_locks.setdefault(deck_id, threading.Lock())
+
+        # 読み込みは全体のロックの外で行い（他のデッキへのアクセスを妨げない）、
+        # 同じデッキを待っているスレッドは最初の読み込みの結果を使う
+        with load_lock:
+            with self._lock:
+                df = self._cached(deck_id, mtime)
+            if df is not None:
+                return df
+
+            df = load_question_bank(info.path, info.sheet_name)
+
+            with self._lock:
+                self._loaded[deck_id] = (mtime, df)
+                self._loaded.move_to_end(deck_id)
+                while len(self._loaded) > self.max_loaded:
+                    self._loaded.popitem(last=False)
+        return df
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    """プロセス内で共有するデッキレジストリ"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = DeckRegistry()
+    return _registry
@@ -0,0 +1,150 @@
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from .config import LOG_DB_PATH, JP_TZ
+from .log_store import connect, to_db_timestamp
+from .stats import record_answer
+
+EVENT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answer_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    question_id INTEGER NOT NULL,
+    chosen_option TEXT NOT NULL,
+    is_correct INTEGER NOT NULL,
+    evaluator_latency_ms REAL,
+    created_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_answer_events_created_at ON answer_events(created_at);
+CREATE INDEX IF NOT EXISTS idx_answer_events_user_id ON answer_events(user_id);
+"""
+
+# 後から追加した列（既存のDBにはALTER TABLEで追加する）
+ADDED_COLUMNS = {
+    'deck_id': 'TEXT',
+}
+
+EVENT_COLUMNS = [
+    'session_id', 'user_id', 'question_id', 'chosen_option',
+    'is_correct', 'evaluator_latency_ms', 'created_at', 'deck_id'
+]
+
+@dataclass(frozen=True)
+class AnswerEvent:
+    """1回の回答を表すイベント"""
+    session_id: str
+    user_id: str
+    question_id: int
+    chosen_option: str
+    is_correct: bool
+    evaluator_latency_ms: float = None
+    created_at: datetime = field(default_factory=lambda: datetime.now(JP_TZ))
+    deck_id: str = None
+
+_conn_lock = threading.Lock()
+_connections = {}
+
+def _get_connection(db_path):
+    """イベントテーブル用の共有コネクションを取得"""
+    conn = _connections.get(db_path)
+    if conn is None:
+        conn = connect(db_path)
+        conn.executescript(EVENT_SCHEMA)
+        existing = {row[1] for row in conn.execute('PRAGMA table_info(answer_events)')}
+        with conn:
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE answer_events ADD COLUMN {column} {column_type}')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_answer_events_deck_user '
+                'ON answer_events(deck_id, user_id)'
+            )
+        _connections[db_path] = conn
+    return conn
+
+def emit_answer_event(event, logger=None, db_path=LOG_DB_PATH):
+    """回答イベントを保存し、統計の集計にも反映する"""
+    row = (
+        event.session_id,
+        str(event.user_id),
+        int(event.question_id),
+        event.chosen_option,
+        1 if event.is_correct else 0,
+        event.evaluator_latency_ms,
+        to_db_timestamp(event.created_at),
+        event.deck_id
+    )
+    with _conn_lock:
+        conn = _get_connection(db_path)
+        with conn:
+            conn.execute(
+                f"INSERT INTO answer_events ({', '.join(EVENT_COLUMNS)}) "
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                row
+            )
+    record_answer(
+        event.user_id, event.question_id, event.is_correct, event.created_at,
+        deck_id=event.deck_id, db_path=db_path
+    )
+
+    if logger is not None:
+        result = '正解' if event.is_correct else '不正解'
+        logger.info(
+            f"回答イベント - ユーザー[{event.user_id}] - {result} - 問題ID: {event.question_id}",
+            extra={'answer_event': dict(zip(EVENT_COLUMNS, row))}
+        )
+
+def load_answer_events(start=None, end=None, user_id=None, db_path=LOG_DB_PATH):
+    """回答イベントを型付きのDataFrameとして読み込む（endは含まない）"""
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append('created_at >= ?')
+        params.append(to_db_timestamp(start))
+    if end is not None:
+        conditions.append('created_at < ?')
+        params.append(to_db_timestamp(end))
+    if user_id:
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    with _conn_lock:
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(EVENT_COLUMNS)} FROM answer_events {where} ORDER BY id",
+            _get_connection(db_path),
+            params=params
+        )
+
+    return df.astype({
+        'session_id': 'string',
+        'user_id': 'category',
+        'question_id': 'int32',
+        'chosen_option': 'string',
+        'is_correct': 'bool',
+        'evaluator_latency_ms': 'float32',
+        'deck_id': 'category',
+    }).assign(created_at=pd.to_datetime(df['created_at'], format='ISO8601'))
+
+def fetch_outcomes_since(last_id, deck_id=None, db_path=LOG_DB_PATH):
+    """id > last_id の回答結果を (id, question_id, is_correct) の配列で返す"""
+    with _conn_lock:
+        rows = _get_connection(db_path).execute(
+            'SELECT id, question_id, is_correct FROM answer_events '
+            'WHERE id > ? AND deck_id IS ? ORDER BY id',
+            (last_id, deck_id)
+        ).fetchall()
+    return np.array(rows, dtype=np.int64).reshape(-1, 3)
+
+def fetch_user_outcomes(user_id, deck_id=None, db_path=LOG_DB_PATH):
+    """ユーザーの過去の回答結果を (question_id, is_correct) の配列で返す"""
+    with _conn_lock:
+        rows = _get_connection(db_path).execute(
+            'SELECT question_id, is_correct FROM answer_events '
+            'WHERE user_id = ? AND deck_id IS ?',
+            (str(user_id), deck_id)
+        ).fetchall()
+    return np.array(rows, dtype=np.int64).reshape(-1, 2)
@@ -1,24 +1,46 @@
-from openai import OpenAI
-from utils.logger import setup_logger
-import asyncio
-from .config import SPREADSHEET_ID, OPENAI_API_KEY
+from utils.logger import LazyLogger
+import json
+import threading
+from .config import EXPLANATIONS_PATH
+from .gpt_cache import GPTCache, make_cache_key
+from . import gpt_service
 
-# OpenAI クライアントの初期化
-client = OpenAI(api_key=OPENAI_API_KEY)
+# 評価に使うモデルとプロンプトのバージョン（プロンプトを変えたら上げる）
+MODEL = "gpt-4"
+TEMPERATURE = 0.4
+PROMPT_VERSION = 1
 
-# loggerの初期化
-logger = setup_logger(spreadsheet_id=SPREADSHEET_ID, user_id="gpt")
+# 画面側で評価結果を待つ最大時間（秒）
+EVALUATION_TIMEOUT = 60.0
 
-async def evaluate_answer_with_gpt(question, options, user_answer):
-    """GPTによる回答評価を行い、結果を返す"""
-    prompt = f"""
+# 評価結果の永続キャッシュ
+evaluation_cache = GPTCache()
+
+# 事前計算済みの評価結果（load_precomputed_explanationsで読み込む）
+_precomputed = None
+_precomputed_lock = threading.Lock()
+
+# loggerの初期化（初回のログ出力時に作成）
+logger = LazyLogger(user_id="gpt")
+
+def build_prompt(question, options, user_answer, correct_answer=None):
+    """評価用のプロンプトを作成
+
+    correct_answerが分かっている場合は、それを正解として解説を生成させる。
+    """
+    if correct_answer:
+        answer_step = f"1. 正解の選択肢は「{correct_answer}」です。これを最も適切な選択肢としてください。（この内容は出力しないでください）"
+    else:
+        answer_step = "1. 問題文と選択肢から最も適切な選択肢を１つ選んでください。（この内容は出力しないでください）"
+
+    return f"""
     問題: {question}
     選択肢: {options}
     ユーザーの回答: {user_answer}
 
     以下の手順でユーザーの回答を評価し、必ず指定された形式で回答してください：
 
-    1. 問題文と選択肢から最も適切な選択肢を１つ選んでください。（この内容は出力しないでください）
+    {answer_step}
     2. ユーザーの回答が最も適切な選択肢と一致するか評価してください。（この内容は出力しないでください）
     3. 以下のフォーマットで厳密に回答してください：
 
@@ -28,30 +50,140 @@ async def evaluate_answer_with_gpt(question, options, user_answer):
     解説: [簡潔な解説]
     """
 
-    try:
-        logger.info(f"GPT評価開始 - 問題: {question}, ユーザー回答: {user_answer}")
-        
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model="gpt-4",
-            temperature=0.4,
-            messages=[
-                {"role": "system", "content": "あなたは海外旅行の豊富な知識を持っていて、ユーザーの回答を評価する優秀な採点者です。必ず指定された形式で回答してください。"},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        gpt_response = response.choices[0].message.content
-        logger.info(f"GPT評価完了 - 結果: {gpt_response}")
-        
-        return gpt_response
+def evaluation_key(question, options, user_answer, correct_answer=None):
+    """評価結果をキャッシュ・事前計算で共有するためのキー"""
+    return make_cache_key(
+        prompt_version=PROMPT_VERSION,
+        model=MODEL,
+        question=question,
+        options=list(options),
+        user_answer=user_answer,
+        correct_answer=correct_answer
+    )
 
-    except Exception as e:
-        error_msg = f"エラーが発生しました: {str(e)}"
-        logger.error(error_msg)
+def build_messages(prompt):
+    """システムメッセージを付けたチャットメッセージを作成"""
+    return [
+        {"role": "system", "content": "あなたは海外旅行の豊富な知識を持っていて、ユーザーの回答を評価する優秀な採点者です。必ず指定された形式で回答してください。"},
+        {"role": "user", "content": prompt}
+    ]
+
+async def request_evaluation(prompt, max_retries=gpt_service.DEFAULT_MAX_RETRIES, circuit_breaker=None):
+    """GPTに評価を依頼する（エラーはそのまま送出）"""
+    return await gpt_service.create_completion(
+        messages=build_messages(prompt),
+        model=MODEL,
+        temperature=TEMPERATURE,
+        max_retries=max_retries,
+        circuit_breaker=circuit_breaker
+    )
+
+def fallback_response(user_answer, correct_answer=None):
+    """GPTが使えない場合の評価結果（正解が分かればローカルで採点）"""
+    if correct_answer:
+        result = "CORRECT" if user_answer == correct_answer else "INCORRECT"
         return f"""
+        RESULT:[{result}]
+        あなたの回答: {user_answer}
+        正解: {correct_answer}
+        解説: 現在、解説を生成できません。しばらくしてからもう一度お試しください。
+        """
+    return f"""
         RESULT:[INCORRECT]
         あなたの回答: {user_answer}
         正解: 評価中にエラーが発生しました
         解説: 申し訳ありません。回答の評価中にエラーが発生しました。もう一度お試しください。
-        """
\ No newline at end of file
+        """
+
+def parse_evaluation(response, user_answer, correct_answer=None):
+    """評価結果のテキストから (回答, 正解, 解説) を取り出す
+
+    correct_answerが分かっている場合は応答中の正解より優先する。
+    """
+    answer = user_answer
+    correct = correct_answer or "解答の取得に失敗しました"
+    explanation = "解説の取得に失敗しました"
+
+    for line in response.split('\n'):
+        line = line.strip()
+        if line.startswith("あなたの回答:"):
+            answer = line.replace("あなたの回答:", "").strip()
+        elif line.startswith("正解:") and not correct_answer:
+            correct = line.replace("正解:", "").strip()
+        elif line.startswith("解説:"):
+            explanation = line.replace("解説:", "").strip()
+    return answer, correct, explanation
+
+def load_precomputed_explanations(path=EXPLANATIONS_PATH):
+    """事前計算済みの評価結果を読み込む（プロセスで1回）"""
+    global _precomputed
+
+    if _precomputed is not None:
+        return _precomputed
+
+    with _precomputed_lock:
+        if _precomputed is not None:
+            return _precomputed
+        try:
+            with open(path, encoding='utf-8') as f:
+                artifact = json.load(f)
+            if artifact.get('prompt_version') == PROMPT_VERSION and artifact.get('model') == MODEL:
+                _precomputed = artifact.get('entries', {})
+            else:
+                logger.warning(f"事前計算ファイルのバージョンが一致しないため使用しません: {path}")
+                _precomputed = {}
+        except FileNotFoundError:
+            _precomputed = {}
+        except (OSError, ValueError) as e:
+            logger.error(f"事前計算ファイルの読み込みに失敗: {str(e)}")
+            _precomputed = {}
+        return _precomputed
+
+def lookup_evaluation(question, options, user_answer, correct_answer=None):
+    """事前計算・キャッシュ済みの評価結果を返す（なければNone、GPTは呼ばない）"""
+    cache_key = evaluation_key(question, options, user_answer, correct_answer)
+    cached = load_precomputed_explanations().get(cache_key)
+    if cached is None:
+        cached = evaluation_cache.get(cache_key)
+    return cached
+
+def stream_evaluation(question, options, user_answer, correct_answer=None, timeout=EVALUATION_TIMEOUT):
+    """評価結果をテキストの断片として順に返す
+
+    事前計算やキャッシュにあれば全文を1回で返し、なければGPTの
+    ストリーミング出力をそのまま返す。同じ評価を同時に求めたセッションは
+    1回のGPT呼び出しの出力を共有し、完了した結果はキャッシュに保存する。
+    """
+    cache_key = evaluation_key(question, options, user_answer, correct_answer)
+    precomputed = load_precomputed_explanations().get(cache_key)
+    if precomputed is not None:
+        evaluation_cache.record_lookup(True)
+        yield precomputed
+        return
+
+    prompt = build_prompt(question, options, user_answer, correct_answer)
+
+    async def produce():
+        logger.info(f"GPT評価開始（ストリーミング） - 問題: {question}, ユーザー回答: {user_answer}")
+        chunks = []
+        async for chunk in gpt_service.stream_completion(
+            messages=build_messages(prompt),
+            model=MODEL,
+            temperature=TEMPERATURE
+        ):
+            chunks.append(chunk)
+            yield chunk
+        logger.info(f"GPT評価完了 - 結果: {''.join(chunks)}")
+
+    received = False
+    try:
+        for chunk in evaluation_cache.stream_or_compute(cache_key, produce, timeout=timeout):
+            received = True
+            yield chunk
+    except Exception as e:
+        if isinstance(e, gpt_service.CircuitOpenError):
+            logger.warning(f"GPT評価をスキップしました: {str(e)}")
+        else:
+            logger.error(f"エラーが発生しました: {str(e)}")
+        if not received:
+            yield fallback_response(user_answer, correct_answer)
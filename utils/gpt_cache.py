@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from .config import GPT_CACHE_DB_PATH
+from .gpt_service import SharedStream
+
+# キャッシュのデフォルト設定
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10000
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS gpt_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_gpt_cache_last_accessed ON gpt_cache(last_accessed);
+"""
+
+def make_cache_key(**parts):
+    """評価の入力からキャッシュキー（SHA-256）を作成"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class GPTCache:
+    """GPTの評価結果を保存する永続キャッシュ
+
+    TTLを過ぎたエントリは読み出し時に破棄し、件数が上限を超えたら
+    最終アクセスが古いものから削除する（LRU）。同じキーへの同時リクエストは
+    1回のGPT呼び出しにまとめる。
+    """
+    def __init__(
+        self,
+        db_path=GPT_CACHE_DB_PATH,
+        ttl_seconds=DEFAULT_TTL_SECONDS,
+        max_entries=DEFAULT_MAX_ENTRIES
+    ):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._conn = None
+
+    def _get_connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(CACHE_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        """キャッシュから値を取得（なければNone）"""
+        now = time.time()
+        with self._lock:
+            conn = self._get_connection()
+            row = conn.execute(
+                'SELECT value, created_at FROM gpt_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            with conn:
+                if now - created_at > self.ttl_seconds:
+                    conn.execute('DELETE FROM gpt_cache WHERE key = ?', (key,))
+                    self.evictions += 1
+                    return None
+                conn.execute(
+                    'UPDATE gpt_cache SET last_accessed = ? WHERE key = ?', (now, key)
+                )
+            return value
+
+    def set(self, key, value):
+        """キャッシュに値を保存し、上限を超えた分を削除"""
+        now = time.time()
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO gpt_cache (key, value, created_at, last_accessed) '
+                    'VALUES (?, ?, ?, ?)',
+                    (key, value, now, now)
+                )
+                count = conn.execute('SELECT COUNT(*) FROM gpt_cache').fetchone()[0]
+                overflow = count - self.max_entries
+                if overflow > 0:
+                    conn.execute(
+                        'DELETE FROM gpt_cache WHERE key IN ('
+                        'SELECT key FROM gpt_cache ORDER BY last_accessed LIMIT ?)',
+                        (overflow,)
+                    )
+                    self.evictions += overflow
+
+    def stream_or_compute(self, key, produce, timeout=None):
+        """キャッシュにあれば全文を1回で返し、なければproduceの出力を断片ごとに返す
+
+        produceは常駐ループ上で読む非同期イテレータを返す関数。同じキーへの
+        同時リクエストは1回の出力を共有し、完了した結果をキャッシュに保存する。
+        timeoutは次の断片を待つ最大時間（秒）。
+        """
+        value = self.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            yield value
+            return
+
+        with self._lock:
+            stream = self._inflight.get(key)
+            if stream is None:
+                stream = SharedStream(
+                    produce(),
+                    on_done=lambda text, error: self._finish_stream(key, text, error)
+                )
+                self._inflight[key] = stream
+                self.misses += 1
+            else:
+                # 別のセッションが同じ評価を実行中なので、その出力を一緒に読む
+                self.coalesced += 1
+            reader = stream.reader(timeout)
+        yield from reader
+
+    def _finish_stream(self, key, text, error):
+        """共有していた出力が終わったら保存し、実行中の一覧から外す"""
+        if error is None:
+            try:
+                self.set(key, text)
+            except sqlite3.Error as e:
+                print(f"GPTキャッシュへの保存に失敗: {str(e)}")
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def record_lookup(self, hit):
+        """stream_or_computeを経由しない参照（事前計算など）のヒット・ミスを記録"""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """ヒット・ミスなどの統計を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            }
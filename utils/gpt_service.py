@@ -0,0 +1,311 @@
+import time
+import random
+import asyncio
+import threading
+from .config import get_openai_api_key
+
+# 1回の呼び出しの締め切り（秒）とリトライ設定
+DEFAULT_DEADLINE = 30.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BASE_DELAY = 0.5
+MAX_BACKOFF = 8.0
+
+# 全セッション共通の同時実行数の上限
+MAX_CONCURRENCY = 8
+
+# サーキットブレーカーの設定
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+_retryable_errors = None
+
+def retryable_errors():
+    """リトライ対象のエラー（429・5xx・タイムアウト・接続エラー）
+
+    openaiは重いので、初めてGPTを呼び出すときに読み込む。
+    """
+    global _retryable_errors
+    if _retryable_errors is None:
+        import openai
+
+        _retryable_errors = (
+            openai.RateLimitError,
+            openai.APIConnectionError,
+            openai.APITimeoutError,
+            openai.InternalServerError,
+            asyncio.TimeoutError,
+        )
+    return _retryable_errors
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出しを行わなかった"""
+
+class CircuitBreaker:
+    """連続失敗が閾値を超えたら一定時間呼び出しを止める
+
+    一定時間が過ぎたら（half_open）1件だけ試しに通し、その成否が
+    記録されるまでほかの呼び出しは止めたままにする。
+    """
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow_request(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            # 試しの1件が結果を記録しないまま終わった場合に備え、一定時間で次を通す
+            if self.probe_started_at is not None and now - self.probe_started_at < self.reset_timeout:
+                return False
+            self.probe_started_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.probe_started_at = None
+
+breaker = CircuitBreaker()
+
+_loop = None
+_loop_lock = threading.Lock()
+_client = None
+_semaphore = None
+
+def get_loop():
+    """評価用の常駐イベントループを返す（初回にスレッドを起動）"""
+    global _loop
+
+    if _loop is not None:
+        return _loop
+
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=loop.run_forever,
+                name='GPTServiceLoop',
+                daemon=True
+            )
+            thread.start()
+            _loop = loop
+        return _loop
+
+def run(coro, timeout=None):
+    """常駐ループ上でコルーチンを実行し、結果を待って返す"""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    return future.result(timeout)
+
+class SharedStream:
+    """常駐ループ上の非同期イテレータの出力を、複数の読み手に断片ごとに配る
+
+    後から加わった読み手も先頭から読む。読み手がすべて途中で閉じられたら
+    上流を取り消し、同時実行数の枠を解放する。完了・失敗・取り消しのいずれでも
+    on_done(全文, エラー) を1回だけ呼ぶ。
+    """
+    def __init__(self, agen, on_done=None):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.readers = 0
+        self._on_done = on_done
+        self._cond = threading.Condition()
+        self._future = asyncio.run_coroutine_threadsafe(self._pump(agen), get_loop())
+        # 実行が始まる前に取り消された場合も終了として扱う
+        self._future.add_done_callback(
+            lambda future: future.cancelled() and self._finish(asyncio.CancelledError())
+        )
+
+    async def _pump(self, agen):
+        try:
+            async for item in agen:
+                with self._cond:
+                    self.chunks.append(item)
+                    self._cond.notify_all()
+        except BaseException as e:
+            self._finish(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        else:
+            self._finish(None)
+
+    def _finish(self, error):
+        with self._cond:
+            if self.done:
+                return
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+        if self._on_done is not None:
+            self._on_done(None if error else ''.join(self.chunks), error)
+
+    def reader(self, timeout=None):
+        """断片を先頭から順に返すイテレータ（timeoutは次の断片を待つ最大秒数）"""
+        with self._cond:
+            self.readers += 1
+        return self._read(timeout)
+
+    def _read(self, timeout):
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    ready = self._cond.wait_for(
+                        lambda: len(self.chunks) > index or self.done, timeout
+                    )
+                    if not ready:
+                        raise TimeoutError(f"GPTの出力が{timeout}秒届きませんでした")
+                    items = self.chunks[index:]
+                    done, error = self.done, self.error
+                yield from items
+                index += len(items)
+                if done:
+                    if isinstance(error, asyncio.CancelledError):
+                        raise RuntimeError("GPTの出力が取り消されました") from error
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self._cond:
+                self.readers -= 1
+                abandoned = self.readers == 0 and not self.done
+            if abandoned:
+                self._future.cancel()
+
+def _get_client():
+    global _client, _semaphore
+    if _client is None:
+        from openai import AsyncOpenAI
+
+        _client = AsyncOpenAI(api_key=get_openai_api_key(), timeout=DEFAULT_DEADLINE, max_retries=0)
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    return _client
+
+def retry_delay(error, attempt, base_delay=DEFAULT_BASE_DELAY):
+    """Retry-Afterヘッダーがあれば優先し、なければ指数バックオフ（ジッター付き）"""
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_BACKOFF)
+        except ValueError:
+            pass
+    return min(base_delay * (2 ** attempt), MAX_BACKOFF) + random.uniform(0, base_delay)
+
+async def create_completion(
+    messages,
+    model,
+    temperature,
+    deadline=DEFAULT_DEADLINE,
+    max_retries=DEFAULT_MAX_RETRIES,
+    base_delay=DEFAULT_BASE_DELAY,
+    circuit_breaker=None
+):
+    """締め切り・リトライ・同時実行数制限・サーキットブレーカー付きでGPTを呼び出す
+
+    常駐ループ（run/get_loop）上で実行すること。circuit_breakerを省略すると
+    画面からの呼び出しと共有のbreakerを使う。
+    """
+    circuit_breaker = circuit_breaker or breaker
+    client = _get_client()
+    for attempt in range(max_retries + 1):
+        if not circuit_breaker.allow_request():
+            raise CircuitOpenError("GPT APIへの呼び出しを一時停止しています")
+        try:
+            async with _semaphore:
+                response = await asyncio.wait_for(
+                    client.chat.completions.create(
+                        model=model,
+                        temperature=temperature,
+                        messages=messages
+                    ),
+                    timeout=deadline
+                )
+            circuit_breaker.record_success()
+            return response.choices[0].message.content
+        except retryable_errors() as e:
+            circuit_breaker.record_failure()
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(retry_delay(e, attempt, base_delay))
+
+async def stream_completion(
+    messages,
+    model,
+    temperature,
+    deadline=DEFAULT_DEADLINE,
+    max_retries=DEFAULT_MAX_RETRIES,
+    base_delay=DEFAULT_BASE_DELAY,
+    circuit_breaker=None
+):
+    """create_completionのストリーミング版（トークンの断片を順に返す）
+
+    リトライはストリームの開始まで。開始後のエラーはそのまま送出する。
+    """
+    circuit_breaker = circuit_breaker or breaker
+    client = _get_client()
+    loop = asyncio.get_running_loop()
+    started_at = loop.time()
+    for attempt in range(max_retries + 1):
+        if not circuit_breaker.allow_request():
+            raise CircuitOpenError("GPT APIへの呼び出しを一時停止しています")
+        # 同時実行数の枠は試行ごとに取り、リトライ待ちの間は手放す
+        await _semaphore.acquire()
+        try:
+            stream = await asyncio.wait_for(
+                client.chat.completions.create(
+                    model=model,
+                    temperature=temperature,
+                    messages=messages,
+                    stream=True
+                ),
+                timeout=deadline
+            )
+            break
+        except retryable_errors() as e:
+            _semaphore.release()
+            circuit_breaker.record_failure()
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(retry_delay(e, attempt, base_delay))
+        except BaseException:
+            _semaphore.release()
+            raise
+
+    # 開始できたストリームは読み終わるまで枠を持ち続ける
+    try:
+        async for chunk in stream:
+            if loop.time() - started_at > deadline:
+                raise asyncio.TimeoutError("GPTのストリーミングが締め切りを過ぎました")
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except retryable_errors():
+        circuit_breaker.record_failure()
+        raise
+    finally:
+        _semaphore.release()
+    circuit_breaker.record_success()
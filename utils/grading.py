@@ -0,0 +1,58 @@
+import re
+import unicodedata
+import pandas as pd
+
+# 問題シートの列名
+ANSWER_COLUMN = '回答'
+OPTION_COLUMNS = {'A': '選択肢A', 'B': '選択肢B', 'C': '選択肢C'}
+# load_data時に付与する正解選択肢の列名
+ANSWER_KEY_COLUMN = '正解選択肢'
+
+_ANSWER_PREFIX = re.compile(r'^\s*回答\s*:?\s*')
+_OPTION_LETTER = re.compile(r'^([ABC])\s*[).:]', re.IGNORECASE)
+
+def _normalize(text):
+    """全角・半角や前後の空白の揺れを吸収する"""
+    return unicodedata.normalize('NFKC', str(text)).strip()
+
+def _option_body(text):
+    """選択肢の先頭の記号（A) など）を除いた本文"""
+    return _OPTION_LETTER.sub('', _normalize(text), count=1).strip()
+
+def parse_answer_key(answer_text, options):
+    """回答列の文字列から正解の選択肢テキストを求める（不明ならNone）"""
+    if answer_text is None or pd.isna(answer_text):
+        return None
+    answer = _ANSWER_PREFIX.sub('', _normalize(answer_text))
+
+    # 先頭の記号（A/B/C）で判定
+    match = _OPTION_LETTER.match(answer)
+    if match and match.group(1).upper() in options:
+        return options[match.group(1).upper()]
+
+    # 記号がない場合は本文の一致で判定
+    answer_body = _option_body(answer)
+    for option in options.values():
+        if _option_body(option) == answer_body:
+            return option
+    return None
+
+def attach_answer_key(df):
+    """問題データに正解選択肢の列を追加したDataFrameを返す"""
+    if ANSWER_COLUMN not in df.columns:
+        return df.assign(**{ANSWER_KEY_COLUMN: None})
+    option_frame = df[list(OPTION_COLUMNS.values())]
+    keys = [
+        parse_answer_key(answer, {
+            letter: option for letter, option in zip(OPTION_COLUMNS, row)
+            if not pd.isna(option)
+        })
+        for answer, row in zip(df[ANSWER_COLUMN], option_frame.itertuples(index=False))
+    ]
+    return df.assign(**{ANSWER_KEY_COLUMN: keys})
+
+def grade_answer(correct_option, user_answer):
+    """正解選択肢とユーザーの回答を比較（正解が不明ならNone）"""
+    if correct_option is None or pd.isna(correct_option):
+        return None
+    return _normalize(correct_option) == _normalize(user_answer)
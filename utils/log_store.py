@@ -0,0 +1,361 @@
+import os
+import json
+import queue
+import sqlite3
+import threading
+import atexit
+import logging
+from datetime import datetime
+from .config import LOG_DB_PATH, JP_TZ
+
+# 書き込みスレッドのバッチ設定
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_MAX_QUEUE_SIZE = 50000
+
+# Google Sheetsへのレプリケーション設定
+DEFAULT_SYNC_INTERVAL = 10.0
+DEFAULT_SYNC_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TIMESTAMP NOT NULL,
+    user_id TEXT,
+    level TEXT NOT NULL,
+    logger_name TEXT,
+    message TEXT NOT NULL,
+    extra_data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_created_at ON logs(created_at);
+CREATE INDEX IF NOT EXISTS idx_user_id ON logs(user_id);
+CREATE INDEX IF NOT EXISTS idx_level ON logs(level);
+CREATE TABLE IF NOT EXISTS sync_state (
+    target TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL
+);
+"""
+
+# LogRecordが標準で持つ属性（extra_dataには呼び出し側が付けた属性だけを保存する）
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+def connect(db_path=LOG_DB_PATH):
+    """WALモードでログDBに接続し、スキーマを用意する"""
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    with _schema_lock:
+        if db_path not in _schema_ready:
+            conn.executescript(SCHEMA)
+            _schema_ready.add(db_path)
+    return conn
+
+def _user_id_from_record(record):
+    """レコードからユーザーIDを取り出す"""
+    user_id = getattr(record, 'user_id', None)
+    if user_id:
+        return str(user_id)
+    prefix = 'xlsx_data_app_'
+    if record.name.startswith(prefix):
+        return record.name[len(prefix):]
+    return None
+
+def record_to_row(record, formatted_message):
+    """LogRecordをlogsテーブルの1行に変換"""
+    created_at = datetime.fromtimestamp(record.created, JP_TZ).isoformat()
+    # user_id・answer_event・log_keyなど、extraで付けた属性だけを残す
+    extra = {
+        key: value for key, value in record.__dict__.items()
+        if key not in _STANDARD_ATTRS
+    }
+    return (
+        created_at,
+        _user_id_from_record(record),
+        record.levelname,
+        record.name,
+        formatted_message,
+        json.dumps(extra, ensure_ascii=False, default=str) if extra else None
+    )
+
+def to_db_timestamp(value):
+    """datetime/dateをcreated_atと比較できるJSTのISO文字列に変換"""
+    if isinstance(value, str):
+        return value
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=JP_TZ)
+    return value.astimezone(JP_TZ).isoformat()
+
+def query_logs(
+    user_id=None,
+    level=None,
+    start=None,
+    end=None,
+    pattern=None,
+    limit=100,
+    cursor=None,
+    db_path=LOG_DB_PATH
+):
+    """条件に一致するログを新しい順に取得する
+
+    戻り値は (rows, next_cursor)。rowsの各要素は
+    (created_at, user_id, level, logger_name, message, extra_data)。
+    next_cursorを次回のcursorに渡すと続きのページを取得できる。
+    endは含まない（start <= created_at < end）。
+    """
+    conditions = []
+    params = []
+    if user_id:
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    if level:
+        conditions.append('level = ?')
+        params.append(level)
+    if start is not None:
+        conditions.append('created_at >= ?')
+        params.append(to_db_timestamp(start))
+    if end is not None:
+        conditions.append('created_at < ?')
+        params.append(to_db_timestamp(end))
+    if pattern:
+        conditions.append("message LIKE ? ESCAPE '\\'")
+        escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        params.append(f'%{escaped}%')
+    if cursor is not None:
+        conditions.append('id < ?')
+        params.append(cursor)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    sql = (
+        'SELECT id, created_at, user_id, level, logger_name, message, extra_data '
+        f'FROM logs {where} ORDER BY id DESC LIMIT ?'
+    )
+    params.append(limit + 1)
+
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return [row[1:] for row in rows[:limit]], next_cursor
+
+class SQLiteLogHandler(logging.Handler):
+    """ローカルのSQLiteにログを保存するハンドラ
+
+    emitはメッセージを整形してキューに積むだけで、行への変換とINSERTは
+    書き込みスレッドがまとめて行う。
+    """
+    def __init__(
+        self,
+        db_path=LOG_DB_PATH,
+        batch_size=DEFAULT_BATCH_SIZE,
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+        max_queue_size=DEFAULT_MAX_QUEUE_SIZE
+    ):
+        super().__init__()
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped_count = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop_event = threading.Event()
+        self._write_lock = threading.Lock()
+        self._conn = connect(db_path)
+        self._worker = threading.Thread(
+            target=self._run_worker,
+            name='SQLiteLogHandler',
+            daemon=True
+        )
+        self._worker.start()
+        atexit.register(self.close)
+
+    def _write_rows(self, items):
+        """キューから取り出した (レコード, 整形済みメッセージ) を1トランザクションでINSERT"""
+        if not items:
+            return
+        try:
+            rows = [record_to_row(record, message) for record, message in items]
+            with self._write_lock, self._conn:
+                self._conn.executemany(
+                    'INSERT INTO logs (created_at, user_id, level, logger_name, message, extra_data) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    rows
+                )
+        except Exception as e:
+            print(f"SQLiteへのログ書き込み中にエラーが発生: {str(e)}")
+            self.handleError(None)
+
+    def _drain(self, max_items):
+        """キューから最大max_items件を取り出す"""
+        items = []
+        while len(items) < max_items:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run_worker(self):
+        """件数または経過時間でまとめて書き込むワーカー"""
+        while not self._stop_event.is_set():
+            try:
+                items = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            items.extend(self._drain(self.batch_size - 1))
+            self._write_rows(items)
+
+    def flush(self):
+        """キューに残っているログをすべて書き込む"""
+        while True:
+            items = self._drain(self.batch_size)
+            if not items:
+                break
+            self._write_rows(items)
+
+    def close(self):
+        """ワーカーを停止し、残りのログを書き込んでから閉じる"""
+        if self._worker is not None:
+            self._stop_event.set()
+            self._worker.join(timeout=self.flush_interval + 5)
+            self._worker = None
+            self.flush()
+            self._conn.close()
+        super().close()
+
+    def emit(self, record):
+        """ログレコードを書き込みキューに積む"""
+        try:
+            item = (record, self.format(record))
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self.dropped_count += 1
+        except Exception as e:
+            print(f"SQLiteへのログ書き込み中にエラーが発生: {str(e)}")
+            self.handleError(record)
+
+class SheetsReplicator:
+    """logsテーブルの新しい行をGoogle Sheetsへ追記するレプリケータ
+
+    送信済みの最大idをsync_stateテーブルに保存し、差分のみを送る。
+    """
+    def __init__(
+        self,
+        spreadsheet_id,
+        sheet_name='logs',
+        db_path=LOG_DB_PATH,
+        interval=DEFAULT_SYNC_INTERVAL,
+        batch_size=DEFAULT_SYNC_BATCH_SIZE
+    ):
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.db_path = db_path
+        self.interval = interval
+        self.batch_size = batch_size
+        self.target = f'sheets:{spreadsheet_id}:{sheet_name}'
+        self._conn = connect(db_path)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _get_last_id(self):
+        row = self._conn.execute(
+            'SELECT last_id FROM sync_state WHERE target = ?', (self.target,)
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        # 初回は既存の行を送らず、現在の末尾から同期を始める
+        row = self._conn.execute('SELECT COALESCE(MAX(id), 0) FROM logs').fetchone()
+        self._set_last_id(row[0])
+        return row[0]
+
+    def _set_last_id(self, last_id):
+        with self._conn:
+            self._conn.execute(
+                'INSERT INTO sync_state (target, last_id) VALUES (?, ?) '
+                'ON CONFLICT(target) DO UPDATE SET last_id = excluded.last_id',
+                (self.target, last_id)
+            )
+
+    def sync_once(self):
+        """未送信の行を1バッチ送信し、送信した件数を返す"""
+        from .sheets import get_spreadsheets, ensure_sheet
+        from .timing import span
+
+        last_id = self._get_last_id()
+        rows = self._conn.execute(
+            'SELECT id, message FROM logs WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, self.batch_size)
+        ).fetchall()
+        if not rows:
+            return 0
+
+        ensure_sheet(self.spreadsheet_id, self.sheet_name, headers=['Log Message'])
+        with span('sheets_append'):
+            get_spreadsheets().values().append(
+                spreadsheetId=self.spreadsheet_id,
+                range=f'{self.sheet_name}!A:A',
+                valueInputOption='USER_ENTERED',
+                body={'values': [[message] for _, message in rows]}
+            ).execute()
+        self._set_last_id(rows[-1][0])
+        return len(rows)
+
+    def _run(self):
+        # 起動直後は待つ（起動処理と同時にGoogle Sheetsへ接続しない）
+        while not self._stop_event.wait(self.interval):
+            try:
+                # バックログがある間は待たずに続けて送信
+                while self.sync_once() == self.batch_size:
+                    pass
+            except Exception as e:
+                print(f"Google Sheetsへの同期中にエラーが発生: {str(e)}")
+
+    def start(self):
+        """バックグラウンドで同期を開始"""
+        if self._thread is not None:
+            return
+        # 最初の同期は1間隔後なので、開始時点の末尾をここで確定しておく
+        self._get_last_id()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='SheetsReplicator',
+            daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """同期を停止し、最後に残りを送信"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=self.interval + 5)
+        self._thread = None
+        try:
+            self.sync_once()
+        except Exception as e:
+            print(f"Google Sheetsへの最終同期中にエラーが発生: {str(e)}")
+
+_replicators = {}
+_replicators_lock = threading.Lock()
+
+def start_replicator(spreadsheet_id, sheet_name='logs', db_path=LOG_DB_PATH):
+    """プロセスごとに1つのレプリケータを起動して返す"""
+    key = (spreadsheet_id, sheet_name, db_path)
+    with _replicators_lock:
+        replicator = _replicators.get(key)
+        if replicator is None:
+            replicator = SheetsReplicator(spreadsheet_id, sheet_name, db_path)
+            replicator.start()
+            _replicators[key] = replicator
+        return replicator
@@ -1,44 +1,71 @@
 import os
 import sys
-from google.oauth2 import service_account
-import google_auth_httplib2
-import httplib2
-from googleapiclient.discovery import build
-from googleapiclient.http import HttpRequest
-from googleapiclient.errors import HttpError
 import logging
 import json
+import random
 from datetime import datetime
-import pytz
 import time
-import streamlit as st
-from .config import SPREADSHEET_ID
+import queue
+import threading
+import atexit
+import contextvars
+from collections import OrderedDict
+from .config import (
+    JP_TZ,
+    get_spreadsheet_id,
+    MAX_USER_LOGGERS,
+    LOG_DEDUP_WINDOW,
+    LOG_SAMPLE_RATES,
+    LOG_RATE_PER_USER,
+    LOG_BURST_PER_USER,
+    LOG_POLICY_MAX_KEYS
+)
+from .sheets import get_spreadsheets, ensure_sheet
+from .log_store import SQLiteLogHandler, start_replicator
+from .timing import span
+# ハンドラを持つロガー（プロセスで共有）
+_logger = None
+_logger_lock = threading.Lock()
+# ユーザーごとのロガー（アダプタ）。使われていないものから捨てる
+_user_loggers = OrderedDict()
 
-SCOPE = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive"
-]
-JP_TZ = pytz.timezone('Asia/Tokyo')
-
-# グローバル変数としてloggerを定義
-logger = None
+# 実行中のスクリプトのユーザー（user_idを指定しないロガーのレコードに付ける）
+_current_user_id = contextvars.ContextVar('current_user_id', default=None)
 
 class JSTFormatter(logging.Formatter):
-    """JSTタイムゾーンに対応したフォーマッタ"""
+    """JSTタイムゾーンに対応したフォーマッタ
+
+    時刻の文字列は秒単位でキャッシュする。同じフォーマッタを共有する
+    ハンドラが同じレコードを続けて出力する場合は、前回の結果を返す。
+    """
+    default_time_format = '%Y-%m-%d %H:%M:%S %Z'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 複数スレッドから使われるため、キャッシュはタプルごと置き換える
+        self._time_cache = (None, None, None)  # (秒, 書式, 文字列)
+        self._last_format = (None, None)  # (レコード, 出力)
+
     def converter(self, timestamp):
-        dt = datetime.fromtimestamp(timestamp, pytz.UTC)
-        return dt.astimezone(JP_TZ)
+        return datetime.fromtimestamp(timestamp, JP_TZ)
 
     def formatTime(self, record, datefmt=None):
-        dt = self.converter(record.created)
-        if datefmt:
-            return dt.strftime(datefmt)
-        return dt.strftime('%Y-%m-%d %H:%M:%S %Z')
+        # 秒未満を含む書式は使わないので、秒が変わったときだけ作り直す
+        second = int(record.created)
+        datefmt = datefmt or self.default_time_format
+        cached_second, cached_datefmt, text = self._time_cache
+        if second != cached_second or datefmt != cached_datefmt:
+            text = self.converter(second).strftime(datefmt)
+            self._time_cache = (second, datefmt, text)
+        return text
 
     def format(self, record):
-        # レコードの作成時刻を確実に現在のUTC時刻に
-        record.created = time.time()
-        return super().format(record)
+        last_record, text = self._last_format
+        if last_record is record:
+            return text
+        text = super().format(record)
+        self._last_format = (record, text)
+        return text
 
 class JSTStreamHandler(logging.StreamHandler):
     """JSTに対応したStreamHandler"""
@@ -55,40 +82,59 @@ class JSTStreamHandler(logging.StreamHandler):
         except Exception:
             self.handleError(record)
 
+# 非同期送信モードのデフォルト設定
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_FLUSH_INTERVAL = 5.0
+DEFAULT_MAX_QUEUE_SIZE = 10000
+DROP_POLICIES = ('drop_newest', 'drop_oldest', 'block')
+
 class GoogleSheetsHandler(logging.Handler):
-    """Google Sheetsにログを保存するハンドラ"""
-    def __init__(self, spreadsheet_id, sheet_name='logs'):
+    """Google Sheetsにログを保存するハンドラ
+
+    async_mode=True の場合、レコードはメモリ上のキューに積まれ、
+    バックグラウンドのワーカースレッドがまとめて1回のappendで送信する。
+    """
+    def __init__(
+        self,
+        spreadsheet_id,
+        sheet_name='logs',
+        async_mode=False,
+        batch_size=DEFAULT_BATCH_SIZE,
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+        max_queue_size=DEFAULT_MAX_QUEUE_SIZE,
+        drop_policy='drop_newest'
+    ):
         super().__init__()
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"不正なdrop_policyです: {drop_policy}")
         self.spreadsheet_id = spreadsheet_id
         self.sheet_name = sheet_name
+        self.async_mode = async_mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.dropped_count = 0
         self.gsheet_connector = self._connect_to_gsheet()
         self._setup_sheet()
+
+        self._queue = None
+        self._worker = None
+        self._stop_event = threading.Event()
+        if self.async_mode:
+            self._queue = queue.Queue(maxsize=max_queue_size)
+            self._worker = threading.Thread(
+                target=self._run_worker,
+                name=f'GoogleSheetsHandler-{sheet_name}',
+                daemon=True
+            )
+            self._worker.start()
+            # プロセス終了時に残りのログを送信
+            atexit.register(self.close)
     
     def _connect_to_gsheet(self):
-        """Streamlitのシークレットを使用してGoogle Sheetsに接続"""
+        """プロセス共有のGoogle Sheetsクライアントを取得"""
         try:
-            credentials = service_account.Credentials.from_service_account_info(
-                st.secrets["connections"]["gcs"],
-                scopes=SCOPE
-            )
-            
-            def build_request(http, *args, **kwargs):
-                new_http = google_auth_httplib2.AuthorizedHttp(
-                    credentials, http=httplib2.Http()
-                )
-                return HttpRequest(new_http, *args, **kwargs)
-                
-            authorized_http = google_auth_httplib2.AuthorizedHttp(
-                credentials, http=httplib2.Http()
-            )
-            
-            service = build(
-                "sheets",
-                "v4",
-                requestBuilder=build_request,
-                http=authorized_http
-            )
-            return service.spreadsheets()
+            return get_spreadsheets()
         except Exception as e:
             print(f"Google Sheets接続エラー: {str(e)}")
             self.handleError(None)
@@ -96,35 +142,10 @@ class GoogleSheetsHandler(logging.Handler):
 
     def _setup_sheet(self):
         """シートの存在確認と初期設定"""
+        from googleapiclient.errors import HttpError
+
         try:
-            spreadsheet = self.gsheet_connector.get(
-                spreadsheetId=self.spreadsheet_id
-            ).execute()
-            
-            sheets = spreadsheet.get('sheets', [])
-            sheet_names = [sheet['properties']['title'] for sheet in sheets]
-            
-            if self.sheet_name not in sheet_names:
-                request = {
-                    'addSheet': {
-                        'properties': {
-                            'title': self.sheet_name
-                        }
-                    }
-                }
-                self.gsheet_connector.batchUpdate(
-                    spreadsheetId=self.spreadsheet_id,
-                    body={'requests': [request]}
-                ).execute()
-            
-            headers = ['Log Message']
-            self.gsheet_connector.values().update(
-                spreadsheetId=self.spreadsheet_id,
-                range=f'{self.sheet_name}!A1',
-                valueInputOption='RAW',
-                body={'values': [headers]}
-            ).execute()
-            
+            ensure_sheet(self.spreadsheet_id, self.sheet_name, headers=['Log Message'])
         except HttpError as e:
             print(f"シートの初期化中にエラーが発生: {e}")
             self.handleError(None)
@@ -133,49 +154,287 @@ class GoogleSheetsHandler(logging.Handler):
     def add_row_to_gsheet(self, row_data):
         """Google Sheetsに1行のデータを追加"""
         try:
-            self.gsheet_connector.values().append(
-                spreadsheetId=self.spreadsheet_id,
-                range=f'{self.sheet_name}!A:A',
-                valueInputOption='USER_ENTERED',
-                body={'values': [[row_data]]}
-            ).execute()
+            with span('sheets_append'):
+                self.gsheet_connector.values().append(
+                    spreadsheetId=self.spreadsheet_id,
+                    range=f'{self.sheet_name}!A:A',
+                    valueInputOption='USER_ENTERED',
+                    body={'values': [[row_data]]}
+                ).execute()
             return True
         except Exception as e:
             print(f"行の追加中にエラーが発生: {str(e)}")
             self.handleError(None)
             return False
 
+    def add_rows_to_gsheet(self, rows):
+        """Google Sheetsに複数行のデータを1回のリクエストで追加"""
+        if not rows:
+            return True
+        try:
+            with span('sheets_append'):
+                self.gsheet_connector.values().append(
+                    spreadsheetId=self.spreadsheet_id,
+                    range=f'{self.sheet_name}!A:A',
+                    valueInputOption='USER_ENTERED',
+                    body={'values': [[row] for row in rows]}
+                ).execute()
+            return True
+        except Exception as e:
+            print(f"複数行の追加中にエラーが発生: {str(e)}")
+            self.handleError(None)
+            return False
+
+    def _enqueue(self, formatted_message):
+        """キューにメッセージを積む（満杯時はdrop_policyに従う）"""
+        if self.drop_policy == 'block':
+            self._queue.put(formatted_message)
+            return
+        try:
+            self._queue.put_nowait(formatted_message)
+            return
+        except queue.Full:
+            pass
+        if self.drop_policy == 'drop_oldest':
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(formatted_message)
+            except queue.Full:
+                pass
+        self.dropped_count += 1
+
+    def _drain(self, max_items):
+        """キューから最大max_items件を取り出す"""
+        rows = []
+        while len(rows) < max_items:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run_worker(self):
+        """件数または経過時間でまとめてGoogle Sheetsへ送信するワーカー"""
+        while not self._stop_event.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            rows = []
+            while len(rows) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 or self._stop_event.is_set():
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.add_rows_to_gsheet(rows)
+
+    def flush(self):
+        """キューに残っているログをすべて送信"""
+        if not self.async_mode or self._queue is None:
+            return
+        while True:
+            rows = self._drain(self.batch_size)
+            if not rows:
+                break
+            self.add_rows_to_gsheet(rows)
+
+    def close(self):
+        """ワーカーを停止し、残りのログを送信してから閉じる"""
+        if self.async_mode and self._worker is not None:
+            self._stop_event.set()
+            self._worker.join(timeout=self.flush_interval + 5)
+            self._worker = None
+            self.flush()
+        super().close()
+
     def emit(self, record):
         """ログレコードをGoogle Sheetsに書き込む"""
         try:
             formatted_message = self.format(record)
-            self.add_row_to_gsheet(formatted_message)
+            if self.async_mode:
+                self._enqueue(formatted_message)
+            else:
+                self.add_row_to_gsheet(formatted_message)
         except Exception as e:
             print(f"Google Sheetsへのログ書き込み中にエラーが発生: {str(e)}")
             self.handleError(record)
 
+def set_current_user(user_id):
+    """現在のコンテキスト（スクリプトの実行）のユーザーを設定"""
+    _current_user_id.set(None if user_id is None else str(user_id))
+
+class UserContextFilter(logging.Filter):
+    """user_idが付いていないレコードに現在のユーザーを付けるフィルタ"""
+    def filter(self, record):
+        if getattr(record, 'user_id', None) is None:
+            record.user_id = _current_user_id.get()
+        return True
+
+# ログポリシーの対象とする最大のレベル（WARNING以上は常に出力する）
+POLICY_MAX_LEVEL = logging.INFO
+
+class LogPolicyFilter(logging.Filter):
+    """大量に出るINFO以下のログを抑制するフィルタ
+
+    - 重複: extraにlog_keyを付けたログは、同じユーザー・同じlog_keyのものを
+      dedup_windowの間に1回だけ出す（log_keyのないログは重複を判定しない）
+    - サンプリング: レベル名（または "ロガー名:レベル名"）ごとの割合だけ出す
+    - レート制限: ユーザーごとのトークンバケット（毎秒rate件、最大burst件）
+    ユーザーはset_current_userで設定した現在のユーザーを優先し、なければ
+    レコードのuser_idを使う（"gpt" のような固定IDのロガーでも利用者ごとに数える）。
+    抑制した件数は理由ごとに数える。
+    """
+    def __init__(
+        self,
+        dedup_window=LOG_DEDUP_WINDOW,
+        sample_rates=None,
+        rate=LOG_RATE_PER_USER,
+        burst=LOG_BURST_PER_USER,
+        max_keys=LOG_POLICY_MAX_KEYS,
+        seed=None
+    ):
+        super().__init__()
+        self.dedup_window = dedup_window
+        self.sample_rates = dict(LOG_SAMPLE_RATES if sample_rates is None else sample_rates)
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.suppressed = {'dedup': 0, 'sampled': 0, 'rate_limited': 0}
+        self._seen = OrderedDict()  # キー → 最後に出力した時刻
+        self._buckets = OrderedDict()  # ユーザー → (トークン数, 更新時刻)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > POLICY_MAX_LEVEL:
+            return True
+        now = time.monotonic()
+        user_id = _current_user_id.get() or getattr(record, 'user_id', None)
+        log_key = getattr(record, 'log_key', None)
+        dedup = bool(self.dedup_window) and log_key is not None
+        key = (user_id, record.levelno, log_key)
+
+        with self._lock:
+            if dedup:
+                seen_at = self._seen.get(key)
+                if seen_at is not None and now - seen_at < self.dedup_window:
+                    return self._suppress('dedup')
+
+            rate = self.sample_rates.get(f'{record.name}:{record.levelname}')
+            if rate is None:
+                rate = self.sample_rates.get(record.levelname, 1.0)
+            if rate < 1.0 and self._random.random() >= rate:
+                return self._suppress('sampled')
+
+            if user_id is not None and self.rate and not self._take_token(user_id, now):
+                return self._suppress('rate_limited')
+
+            # 出力したものだけを重複の判定に使う
+            if dedup:
+                self._remember(self._seen, key, now)
+        return True
+
+    def _suppress(self, reason):
+        self.suppressed[reason] += 1
+        return False
+
+    def _take_token(self, user_id, now):
+        """ユーザーのバケットからトークンを1つ取り出す（足りなければFalse）"""
+        tokens, updated_at = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._remember(self._buckets, user_id, (tokens, now))
+        return allowed
+
+    def _remember(self, entries, key, value):
+        # 上限を超えたら最も古いキーから捨てる（捨てたユーザーのバケットは満タンに戻る）
+        entries[key] = value
+        entries.move_to_end(key)
+        if len(entries) > self.max_keys:
+            entries.popitem(last=False)
+
+    def stats(self):
+        """抑制した件数（理由ごと）"""
+        with self._lock:
+            return dict(self.suppressed)
+
+# 共有のロガーに付けるログポリシー
+log_policy = LogPolicyFilter()
+
+class UserLoggerAdapter(logging.LoggerAdapter):
+    """レコードのuser_id属性でユーザーを識別するアダプタ
+
+    ハンドラは共有のロガーのものを使うので、ユーザーが増えても
+    ハンドラや接続の数は変わらない。
+    """
+    def __init__(self, logger, user_id=None):
+        super().__init__(logger, {'user_id': user_id})
+
+    @property
+    def user_id(self):
+        return self.extra['user_id']
+
+    def process(self, msg, kwargs):
+        # 呼び出し側のextraも残す
+        if 'extra' in kwargs:
+            kwargs['extra'] = {**self.extra, **kwargs['extra']}
+        else:
+            kwargs['extra'] = self.extra
+        return msg, kwargs
+
 def setup_logger(
-    spreadsheet_id=SPREADSHEET_ID,
+    spreadsheet_id=None,
     log_level=logging.INFO,
     user_id=None,
     encoding='utf-8'
 ):
-    """新しいロガーインスタンスを設定して返す"""
-    global logger
-    
-    if logger is not None:
-        return logger
+    """ユーザー用のロガーを返す
+
+    ハンドラを持つロガーはプロセスで1つだけ作成し（spreadsheet_idとlog_levelは
+    初回のみ使う）、ユーザーにはuser_idを付けるアダプタを返す。
+    """
+    base_logger = _get_base_logger(spreadsheet_id, log_level)
+    key = None if user_id is None else str(user_id)
+    with _logger_lock:
+        adapter = _user_loggers.get(key)
+        if adapter is None:
+            adapter = _user_loggers[key] = UserLoggerAdapter(base_logger, key)
+            if len(_user_loggers) > MAX_USER_LOGGERS:
+                _user_loggers.popitem(last=False)
+        else:
+            _user_loggers.move_to_end(key)
+    return adapter
 
-    logger_name = f'xlsx_data_app_{user_id}' if user_id else 'xlsx_data_app'
-    logger = logging.getLogger(logger_name)
+def _get_base_logger(spreadsheet_id, log_level):
+    """ハンドラを持つロガー（初回のみ作成）"""
+    global _logger
+
+    if _logger is not None:
+        return _logger
+
+    with _logger_lock:
+        if _logger is None:
+            _logger = _create_logger(spreadsheet_id or get_spreadsheet_id(), log_level)
+        return _logger
+
+def _create_logger(spreadsheet_id, log_level):
+    """ハンドラを設定したロガーを作成"""
+    logger = logging.getLogger('xlsx_data_app')
     
-    # 既存のハンドラがある場合はクリア
+    # 既存のハンドラとフィルタがある場合はクリア
     logger.handlers.clear()
+    logger.filters.clear()
     
     try:
-        # Google Sheetsハンドラの設定
-        sheets_handler = GoogleSheetsHandler(spreadsheet_id)
-        sheets_handler.setLevel(log_level)
+        # ローカルSQLiteハンドラの設定（Google Sheetsへはレプリケータが同期）
+        sqlite_handler = SQLiteLogHandler()
+        sqlite_handler.setLevel(log_level)
+        start_replicator(spreadsheet_id)
         
         # コンソールハンドラの設定
         console_handler = JSTStreamHandler()
@@ -187,10 +446,14 @@ def setup_logger(
             datefmt='%Y-%m-%d %H:%M:%S %Z'
         )
         
-        sheets_handler.setFormatter(formatter)
+        sqlite_handler.setFormatter(formatter)
         console_handler.setFormatter(formatter)
+
+        # ユーザーを付けてからログポリシーで絞り込む（ロガーのフィルタは登録順に適用される）
+        logger.addFilter(UserContextFilter())
+        logger.addFilter(log_policy)
         
-        logger.addHandler(sheets_handler)
+        logger.addHandler(sqlite_handler)
         logger.addHandler(console_handler)
         
         logger.setLevel(log_level)
@@ -209,14 +472,16 @@ def get_logs(
     spreadsheet_id,
     user_id=None,
     level=None,
-    limit=100
+    limit=100,
+    sheet_name='logs'
 ):
     """Google Sheetsからログを取得"""
+    from googleapiclient.errors import HttpError
+
     try:
-        handler = GoogleSheetsHandler(spreadsheet_id)
-        result = handler.gsheet_connector.values().get(
+        result = get_spreadsheets().values().get(
             spreadsheetId=spreadsheet_id,
-            range=f'{handler.sheet_name}!A:A'
+            range=f'{sheet_name}!A:A'
         ).execute()
         
         values = result.get('values', [])[1:]  # ヘッダーを除外
@@ -237,6 +502,17 @@ def get_logs(
         print(f"ログの取得エラー: {e}")
         return []
 
-# デフォルトロガーの初期化を防ぐ
-if not logger:
-    logger = setup_logger()
\ No newline at end of file
+class LazyLogger:
+    """初めて使われたときにsetup_loggerを呼ぶロガーの代理
+
+    モジュールのインポート時にハンドラの作成やシートへの接続を行わないため、
+    モジュール変数のロガーはこれを使う。
+    """
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+
+    def __getattr__(self, name):
+        return getattr(setup_logger(**self._kwargs), name)
+
+# デフォルトロガー（初回のログ出力時に初期化）
+logger = LazyLogger()
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""Google SheetsとOpenAIを使わずにアプリを動かすためのスタンドイン
+
+計測用のコマンドから使う。シークレットはダミー値、Google SheetsとOpenAIは
+呼び出しを記録するフェイクに差し替える。フェイクには遅延とエラーを
+指定した割合で注入できる。
+"""
+import re
+import time
+import random
+import asyncio
+import threading
+from types import SimpleNamespace
+from . import config, sheets, gpt_service
+
+OFFLINE_SECRETS = {
+    'SPREADSHEET_ID': 'offline-spreadsheet',
+    'OPENAI_API_KEY': 'sk-offline',
+}
+
+class InjectedError(ConnectionError):
+    """フェイクが注入したエラー"""
+
+class _Request:
+    """execute()で決まった値を返すリクエスト"""
+    def __init__(self, service, method, kwargs, result):
+        self.service = service
+        self.method = method
+        self.kwargs = kwargs
+        self.result = result
+
+    def execute(self, http=None, num_retries=0):
+        self.service.record(self.method, self.kwargs)
+        return self.result
+
+class FakeSpreadsheets:
+    """spreadsheets()リソースのフェイク（呼び出し回数と追記された行を記録）"""
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = {}
+        self.errors = 0
+        self.rows = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def record(self, method, kwargs):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise InjectedError(f"Google Sheetsのエラーを注入しました: {method}")
+        if method == 'values.append':
+            sheet_name = kwargs['range'].split('!')[0]
+            with self._lock:
+                self.rows.setdefault(sheet_name, []).extend(kwargs['body']['values'])
+
+    def get(self, **kwargs):
+        titles = list(self.rows) or ['logs']
+        result = {'sheets': [{'properties': {'title': title}} for title in titles]}
+        return _Request(self, 'get', kwargs, result)
+
+    def batchUpdate(self, **kwargs):
+        return _Request(self, 'batchUpdate', kwargs, {})
+
+    def values(self):
+        return _FakeValues(self)
+
+class _FakeValues:
+    def __init__(self, service):
+        self.service = service
+
+    def append(self, **kwargs):
+        return _Request(self.service, 'values.append', kwargs, {})
+
+    def update(self, **kwargs):
+        return _Request(self.service, 'values.update', kwargs, {})
+
+    def get(self, **kwargs):
+        sheet_name = kwargs['range'].split('!')[0]
+        with self.service._lock:
+            values = [['Log Message']] + list(self.service.rows.get(sheet_name, []))
+        return _Request(self.service, 'values.get', kwargs, {'values': values})
+
+_USER_ANSWER = re.compile(r'ユーザーの回答: (.*)')
+_CORRECT_ANSWER = re.compile(r'正解の選択肢は「(.*?)」')
+
+class FakeOpenAI:
+    """AsyncOpenAIのフェイク（chat.completions.createのみ）
+
+    プロンプトから回答と正解を読み取り、評価形式の応答を返す。
+    エラーはリトライ対象のタイムアウトとして注入する。
+    """
+    def __init__(self, latency=0.0, error_rate=0.0, chunk_size=16, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self.stream_calls = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def response_text(self, messages):
+        prompt = messages[-1]['content']
+        user_answer = _USER_ANSWER.search(prompt).group(1).strip()
+        correct = _CORRECT_ANSWER.search(prompt)
+        correct_answer = correct.group(1) if correct else user_answer
+        result = 'CORRECT' if user_answer == correct_answer else 'INCORRECT'
+        return (
+            f"RESULT:[{result}]\n"
+            f"あなたの回答: {user_answer}\n"
+            f"正解: {correct_answer}\n"
+            f"解説: これはオフライン計測用のダミーの解説です。"
+        )
+
+    async def create(self, model, temperature, messages, stream=False):
+        with self._lock:
+            self.calls += 1
+            self.stream_calls += 1 if stream else 0
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        await asyncio.sleep(self.latency)
+        if failed:
+            raise asyncio.TimeoutError("GPTのエラーを注入しました")
+
+        text = self.response_text(messages)
+        if not stream:
+            message = SimpleNamespace(content=text)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        return self._stream(text)
+
+    async def _stream(self, text):
+        for start in range(0, len(text), self.chunk_size):
+            await asyncio.sleep(0)
+            delta = SimpleNamespace(content=text[start:start + self.chunk_size])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+def use_offline_services(
+    secrets=None,
+    sheets_latency=0.0,
+    sheets_error_rate=0.0,
+    gpt_latency=0.0,
+    gpt_error_rate=0.0,
+    seed=None
+):
+    """シークレット・Google Sheets・OpenAIをスタンドインに差し替える
+
+    戻り値のspreadsheetsとopenaiで呼び出し回数を確認できる。
+    """
+    values = dict(OFFLINE_SECRETS, **(secrets or {}))
+    config.get_secret = values.__getitem__
+
+    spreadsheets = FakeSpreadsheets(sheets_latency, sheets_error_rate, seed)
+    sheets._spreadsheets = spreadsheets
+
+    client = FakeOpenAI(gpt_latency, gpt_error_rate, seed=seed)
+    gpt_service._client = client
+    gpt_service._semaphore = asyncio.Semaphore(gpt_service.MAX_CONCURRENCY)
+    return SimpleNamespace(spreadsheets=spreadsheets, openai=client)
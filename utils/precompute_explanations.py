@@ -0,0 +1,109 @@
+"""問題バンク全体の評価結果を事前計算するバッチ
+
+使い方:
+    python -m utils.precompute_explanations [--concurrency 4] [--force]
+
+全ての問題と選択肢の組み合わせについてGPT評価を実行し、結果を
+EXPLANATIONS_PATH に保存する。既存ファイルにある組み合わせ（内容の
+ハッシュが同じもの）は再計算しない。
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+from datetime import datetime
+import pandas as pd
+from .config import QUIZ_DATA_PATH, SHEET_NAME, EXPLANATIONS_PATH
+from .grading import ANSWER_KEY_COLUMN, OPTION_COLUMNS, attach_answer_key
+from .question_bank import file_hash
+from .gpt import MODEL, PROMPT_VERSION, build_prompt, evaluation_key, request_evaluation
+from . import gpt_service
+
+def load_artifact(path):
+    """既存の事前計算ファイルを読み込む（なければ空）"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            artifact = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if artifact.get('prompt_version') != PROMPT_VERSION or artifact.get('model') != MODEL:
+        return {}
+    return artifact.get('entries', {})
+
+def write_artifact(path, entries, source_hash):
+    """事前計算ファイルをアトミックに書き出す"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    artifact = {
+        'prompt_version': PROMPT_VERSION,
+        'model': MODEL,
+        'source_hash': source_hash,
+        'generated_at': datetime.now().isoformat(),
+        'entries': entries,
+    }
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(artifact, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def iter_jobs(df):
+    """(キー, プロンプト) の組を全問題・全選択肢について列挙"""
+    for _, row in df.iterrows():
+        options = [row[column] for column in OPTION_COLUMNS.values()]
+        correct_answer = row.get(ANSWER_KEY_COLUMN)
+        if pd.isna(correct_answer):
+            correct_answer = None
+        for option in options:
+            if pd.isna(option):
+                continue
+            key = evaluation_key(row['質問'], options, option, correct_answer)
+            yield key, build_prompt(row['質問'], options, option, correct_answer)
+
+async def precompute(df, entries, concurrency, max_retries):
+    """未計算の組み合わせを並行して評価し、entriesを更新して返す"""
+    jobs = dict(iter_jobs(df))
+    # 問題バンクに存在しなくなった組み合わせは削除
+    entries = {key: value for key, value in entries.items() if key in jobs}
+    pending = {key: prompt for key, prompt in jobs.items() if key not in entries}
+    print(f"全{len(jobs)}件中、{len(pending)}件を計算します")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    # バッチの失敗で画面からの評価まで止めないよう、専用のブレーカーを使う
+    circuit_breaker = gpt_service.CircuitBreaker()
+
+    async def run(key, prompt):
+        try:
+            async with semaphore:
+                entries[key] = await request_evaluation(
+                    prompt, max_retries=max_retries, circuit_breaker=circuit_breaker
+                )
+        except Exception as e:
+            print(f"評価に失敗しました（スキップ）: {str(e)}")
+
+    await asyncio.gather(*(run(key, prompt) for key, prompt in pending.items()))
+    return entries
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="問題バンクの評価結果を事前計算する")
+    parser.add_argument('--source', default=QUIZ_DATA_PATH)
+    parser.add_argument('--sheet', default=SHEET_NAME)
+    parser.add_argument('--output', default=EXPLANATIONS_PATH)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--max-retries', type=int, default=5)
+    parser.add_argument('--force', action='store_true', help="既存の結果を使わずに全件再計算する")
+    args = parser.parse_args(argv)
+
+    df = attach_answer_key(pd.read_excel(args.source, sheet_name=args.sheet, index_col=0))
+    entries = {} if args.force else load_artifact(args.output)
+    # GPTクライアントは常駐ループ上で動くため、バッチも同じループで実行
+    entries = gpt_service.run(precompute(
+        df, entries, args.concurrency, args.max_retries
+    ))
+    write_artifact(args.output, entries, file_hash(args.source))
+    print(f"{len(entries)}件を {args.output} に保存しました")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
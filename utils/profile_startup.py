@@ -0,0 +1,216 @@
+"""起動時間とインポート時間の計測
+
+使い方:
+    python -m utils.profile_startup [--repeat 3] [--output reports/startup_profile.json]
+
+streamlit_app・components.*・utils.* をそれぞれ新しいインタプリタで
+インポートして時間とメモリを計り、続けて問題データの読み込み、
+最初のsetup_logger、最初のGPTクライアント作成を計測する。
+Google SheetsとOpenAIはutils.offlineのスタンドインを使うので
+ネットワークには接続しない。結果はJSONで書き出す。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import pkgutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT = os.path.join('reports', 'startup_profile.json')
+DEFAULT_REPEAT = 3
+
+# 新しいインタプリタでモジュールを1つインポートして計測するスクリプト
+_IMPORT_PROBE = """
+import sys, json, time, importlib
+try:
+    import resource
+    def peak_kb():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+except ImportError:
+    def peak_kb():
+        return None
+modules_before = len(sys.modules)
+rss_before = peak_kb()
+started_at = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - started_at
+rss_after = peak_kb()
+print(json.dumps({
+    'seconds': seconds,
+    'peak_rss_kb': rss_after,
+    'rss_delta_kb': None if rss_before is None else rss_after - rss_before,
+    'modules_loaded': len(sys.modules) - modules_before,
+}))
+"""
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def app_modules():
+    """計測対象のモジュール名（streamlit_app・components.*・utils.*）"""
+    modules = ['streamlit_app']
+    for package in ('components', 'utils'):
+        path = os.path.join(PROJECT_ROOT, package)
+        modules.extend(
+            f'{package}.{info.name}' for info in pkgutil.iter_modules([path])
+            if info.name != 'profile_startup'
+        )
+    return modules
+
+def measure_import(module, repeat=DEFAULT_REPEAT):
+    """モジュールを新しいインタプリタでrepeat回インポートし、中央値を返す"""
+    samples = []
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, '-c', _IMPORT_PROBE, module],
+            cwd=PROJECT_ROOT,
+            capture_output=True,
+            text=True
+        )
+        if completed.returncode != 0:
+            error = completed.stderr.strip().splitlines()
+            return {'module': module, 'error': error[-1] if error else 'unknown error'}
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    return {
+        'module': module,
+        'seconds': statistics.median(s['seconds'] for s in samples),
+        'seconds_min': min(s['seconds'] for s in samples),
+        'rss_delta_kb': statistics.median(
+            s['rss_delta_kb'] for s in samples if s['rss_delta_kb'] is not None
+        ) if samples[0]['rss_delta_kb'] is not None else None,
+        'modules_loaded': samples[0]['modules_loaded'],
+    }
+
+def _timed(name, func):
+    """funcを1回実行して時間とピークメモリの増分を記録"""
+    rss_before = _peak_rss_kb()
+    started_at = time.perf_counter()
+    error = None
+    try:
+        func()
+    except Exception as e:
+        error = f'{type(e).__name__}: {str(e)}'
+    result = {
+        'phase': name,
+        'seconds': time.perf_counter() - started_at,
+        'rss_delta_kb': None if rss_before is None else _peak_rss_kb() - rss_before,
+    }
+    if error:
+        result['error'] = error
+    return result
+
+def _construct_gpt_client():
+    """スタンドインを外して本物のGPTクライアントを作成（接続はしない）"""
+    from . import gpt_service
+
+    gpt_service._client = None
+    gpt_service._get_client()
+
+def measure_phases(workdir):
+    """初回呼び出しのコストを計測（作業ディレクトリは使い捨て）"""
+    if PROJECT_ROOT not in sys.path:
+        sys.path.insert(0, PROJECT_ROOT)
+
+    from .offline import use_offline_services
+    services = use_offline_services()
+
+    from .config import QUIZ_DATA_PATH
+    from .deck_registry import DeckRegistry, DEFAULT_DECK_ID
+    from .logger import setup_logger
+
+    source = os.path.join(PROJECT_ROOT, QUIZ_DATA_PATH)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        phases = [
+            # コンパイル済みファイルがない状態（Excelの読み込みとコンパイル）
+            _timed('load_data_cold', lambda: DeckRegistry([source], decks_dir=None).get_deck(DEFAULT_DECK_ID)),
+            # コンパイル済みファイルのメモリマップ読み込み
+            _timed('load_data_warm', lambda: DeckRegistry([source], decks_dir=None).get_deck(DEFAULT_DECK_ID)),
+            _timed('setup_logger_first', lambda: setup_logger(user_id='profile')),
+            _timed('gpt_client_first', _construct_gpt_client),
+        ]
+    finally:
+        os.chdir(cwd)
+    return phases, dict(services.spreadsheets.calls)
+
+def _git_revision():
+    try:
+        completed = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=PROJECT_ROOT, capture_output=True, text=True
+        )
+    except OSError:
+        return None
+    return completed.stdout.strip() or None
+
+def build_report(repeat=DEFAULT_REPEAT):
+    """計測を行い、レポートの辞書を返す"""
+    # Streamlit自体のインポートは比較の基準として別に計る
+    imports = [measure_import('streamlit', repeat)]
+    imports.extend(measure_import(module, repeat) for module in app_modules())
+
+    workdir = tempfile.mkdtemp(prefix='profile_startup_')
+    try:
+        phases, sheets_calls = measure_phases(workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'imports': imports,
+        'phases': phases,
+        'sheets_calls': sheets_calls,
+    }
+
+def print_summary(report):
+    """レポートの概要を表形式で表示"""
+    print(f"{'module / phase':<40} {'seconds':>9} {'rss KB':>9}")
+    for row in report['imports'] + report['phases']:
+        name = row.get('module') or row.get('phase')
+        if 'error' in row and 'seconds' not in row:
+            print(f"{name:<40} {'error':>9}  {row['error']}")
+            continue
+        rss = row.get('rss_delta_kb')
+        print(f"{name:<40} {row['seconds']:>9.3f} {rss if rss is not None else '-':>9}")
+        if 'error' in row:
+            print(f"{'':<40} {row['error']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="起動時間とインポート時間を計測する")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    args = parser.parse_args(argv)
+
+    report = build_report(args.repeat)
+    print_summary(report)
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"レポートを {args.output} に書き出しました")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
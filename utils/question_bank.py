@@ -0,0 +1,150 @@
+"""問題データのコンパイル済みファイルの作成と読み込み
+
+Excelの問題シートをArrow IPC形式に変換しておき、起動時はそれを
+メモリマップで読み込む。元のExcelの方が新しく、記録した内容のハッシュとも
+一致しない場合のみExcelを読み直す。
+
+使い方:
+    python -m utils.question_bank [--source f_kaigai.xlsx] [--sheet sheet1]
+"""
+import os
+import sys
+import hashlib
+import tempfile
+import argparse
+import pandas as pd
+from .config import QUIZ_DATA_PATH, SHEET_NAME, COMPILED_DATA_DIR
+from .grading import attach_answer_key
+
+# コンパイル形式のバージョン（形式を変えたら上げる）
+FORMAT_VERSION = '1'
+
+def source_key(path):
+    """別のディレクトリにある同名のファイルと区別するための、解決済みパスの短いハッシュ"""
+    return hashlib.sha256(os.path.realpath(path).encode('utf-8')).hexdigest()[:8]
+
+def compiled_path_for(source, sheet_name, compiled_dir=COMPILED_DATA_DIR):
+    """Excelファイルとシート名に対応するコンパイル済みファイルのパス"""
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(compiled_dir, f'{stem}.{source_key(source)}.{sheet_name}.arrow')
+
+def file_hash(path):
+    """ファイル内容のSHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_workbook(source, sheet_name):
+    """Excelから問題データを読み込み、正解選択肢の列を付ける"""
+    df = pd.read_excel(source, sheet_name=sheet_name, index_col=0)
+    return attach_answer_key(df)
+
+def compile_workbook(source=QUIZ_DATA_PATH, sheet_name=SHEET_NAME, output=None, df=None):
+    """問題データをArrow IPCファイルに書き出し、出力先のパスを返す"""
+    import pyarrow as pa
+
+    output = output or compiled_path_for(source, sheet_name)
+    if df is None:
+        df = read_workbook(source, sheet_name)
+
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update({
+        b'format_version': FORMAT_VERSION.encode(),
+        b'source_hash': file_hash(source).encode(),
+        b'sheet_name': sheet_name.encode('utf-8'),
+    })
+    table = table.replace_schema_metadata(metadata)
+
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # 同じプロセスの別スレッドと一時ファイルが衝突しないよう、書き手ごとに作る
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f'{os.path.basename(output)}.', suffix='.tmp', dir=directory or '.'
+    )
+    os.close(fd)
+    try:
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, output)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return output
+
+def _is_fresh(compiled, source):
+    """コンパイル済みファイルが元のExcelより新しいか"""
+    try:
+        return os.path.getmtime(compiled) >= os.path.getmtime(source)
+    except OSError:
+        return False
+
+def _same_source(compiled, source):
+    """コンパイル済みファイルに記録した元のExcelのハッシュが今の内容と一致するか"""
+    import pyarrow as pa
+
+    try:
+        with pa.memory_map(compiled, 'r') as f:
+            metadata = pa.ipc.open_file(f).schema.metadata or {}
+        return metadata.get(b'source_hash') == file_hash(source).encode()
+    except (OSError, pa.ArrowException):
+        return False
+
+def read_compiled(path):
+    """コンパイル済みファイルをメモリマップで読み込む
+
+    列はArrowのバッファをそのまま参照するため、同じファイルを読む
+    複数のワーカープロセスで物理メモリのページが共有される。
+    """
+    import pyarrow as pa
+
+    source = pa.memory_map(path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    if table.schema.metadata.get(b'format_version') != FORMAT_VERSION.encode():
+        raise ValueError(f"コンパイル済みファイルの形式が異なります: {path}")
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+def load_question_bank(source=QUIZ_DATA_PATH, sheet_name=SHEET_NAME, compiled=None):
+    """問題データを読み込む（コンパイル済みファイルを優先）"""
+    import pyarrow as pa
+
+    compiled = compiled or compiled_path_for(source, sheet_name)
+    fresh = _is_fresh(compiled, source)
+    if not fresh and os.path.exists(compiled) and _same_source(compiled, source):
+        # チェックアウトなどで更新日時だけ変わった場合は読み直さない
+        fresh = True
+        try:
+            os.utime(compiled)
+        except OSError:
+            pass
+    if fresh:
+        try:
+            return read_compiled(compiled)
+        except (OSError, ValueError, pa.ArrowException) as e:
+            print(f"コンパイル済み問題データの読み込みに失敗: {str(e)}")
+
+    # Excelの内容が変わった（またはコンパイル済みファイルがない）場合
+    df = read_workbook(source, sheet_name)
+    try:
+        compile_workbook(source, sheet_name, compiled, df=df)
+    except (OSError, pa.ArrowException) as e:
+        print(f"問題データのコンパイルに失敗: {str(e)}")
+    return df
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="問題データをコンパイルする")
+    parser.add_argument('--source', default=QUIZ_DATA_PATH)
+    parser.add_argument('--sheet', default=SHEET_NAME)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    output = compile_workbook(args.source, args.sheet, args.output)
+    print(f"{args.source} ({args.sheet}) を {output} にコンパイルしました")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""クイズのセッション状態をコンパクトに保持する
+
+問題はデッキ内の位置（0始まりの行番号）で表し、回答済み・正解は
+ビット列、回答順と選んだ選択肢は数値配列で持つ。問題文や解説の文字列は
+コピーせず、表示するときに共有の問題データと評価キャッシュから引く。
+"""
+from array import array
+
+class QuizState:
+    """1セッション分の回答状況"""
+    __slots__ = ('size', 'answered', 'correct', 'positions', 'choices')
+
+    def __init__(self, size):
+        self.size = size
+        nbytes = (size + 7) // 8
+        self.answered = bytearray(nbytes)
+        self.correct = bytearray(nbytes)
+        # 回答した順の問題の位置と、選んだ選択肢の番号（0=A, 1=B, 2=C）
+        self.positions = array('I')
+        self.choices = bytearray()
+
+    @property
+    def total_attempted(self):
+        return len(self.positions)
+
+    @property
+    def correct_count(self):
+        return int.from_bytes(self.correct, 'little').bit_count()
+
+    def is_answered(self, position):
+        return bool(self.answered[position >> 3] & (1 << (position & 7)))
+
+    def is_correct(self, position):
+        return bool(self.correct[position >> 3] & (1 << (position & 7)))
+
+    def record(self, position, choice, is_correct):
+        """回答を記録（回答済みの問題なら何もしない）。記録したらTrue"""
+        if self.is_answered(position):
+            return False
+        self.answered[position >> 3] |= 1 << (position & 7)
+        if is_correct:
+            self.correct[position >> 3] |= 1 << (position & 7)
+        self.positions.append(position)
+        self.choices.append(choice)
+        return True
+
+    def history(self):
+        """回答した順に (問題の位置, 選択肢の番号, 正解か) を返す"""
+        for position, choice in zip(self.positions, self.choices):
+            yield position, choice, self.is_correct(position)
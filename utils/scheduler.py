@@ -0,0 +1,73 @@
+import zlib
+import numpy as np
+
+def seed_from(value):
+    """文字列（セッションIDなど）から再現可能な乱数シードを作成"""
+    return zlib.crc32(str(value).encode('utf-8'))
+
+def error_rate_weights(question_ids, question_stats, prior=1.0):
+    """問題別の (question_id, 回答数, 正解数) から誤答率ベースの重みを作成
+
+    回答が少ない問題は事前分布（正答率50%）に寄せる。
+    """
+    attempts = dict.fromkeys(question_ids, 0)
+    wrong = dict.fromkeys(question_ids, 0)
+    for question_id, n_attempts, n_correct in question_stats:
+        if question_id in attempts:
+            attempts[question_id] = n_attempts
+            wrong[question_id] = n_attempts - n_correct
+    attempts = np.fromiter((attempts[q] for q in question_ids), dtype=np.float64, count=len(question_ids))
+    wrong = np.fromiter((wrong[q] for q in question_ids), dtype=np.float64, count=len(question_ids))
+    return (wrong + prior) / (attempts + 2 * prior)
+
+class QuestionScheduler:
+    """セッション開始時に出題順を決め、カーソルを進めるだけで次の問題を返す
+
+    weightsを指定すると重みに比例して前に来やすい順列を作る
+    （重み付き非復元抽出）。
+    """
+    __slots__ = ('order', 'position')
+
+    def __init__(self, question_ids, seed=None, weights=None):
+        rng = np.random.default_rng(seed)
+        question_ids = np.asarray(question_ids)
+        if weights is None:
+            order = rng.permutation(len(question_ids))
+        else:
+            weights = np.clip(np.asarray(weights, dtype=np.float64), 1e-9, None)
+            # Efraimidis-Spirakis法: u^(1/w) の降順が重み付きの順列になる
+            keys = rng.random(len(question_ids)) ** (1.0 / weights)
+            order = np.argsort(-keys, kind='stable')
+        self.order = question_ids[order]
+        self.position = 0
+
+    def __len__(self):
+        return len(self.order)
+
+    @property
+    def remaining(self):
+        return len(self.order) - self.position
+
+    def current(self):
+        """現在の問題ID（出題し終えていればNone）"""
+        if self.position >= len(self.order):
+            return None
+        question_id = self.order[self.position]
+        return question_id.item() if isinstance(question_id, np.generic) else question_id
+
+    def record(self, question_id, is_correct):
+        """回答結果を反映（固定の出題順なので何もしない）"""
+
+    def resume(self, history, question_id):
+        """保存した途中経過から再開（出題順は同じシードで再現される）"""
+        if question_id is None:
+            self.position = len(self.order)
+            return
+        matches = np.flatnonzero(self.order == question_id)
+        if len(matches):
+            self.position = int(matches[0])
+
+    def advance(self):
+        """次の問題に進み、その問題IDを返す（なければNone）"""
+        self.position += 1
+        return self.current()
@@ -0,0 +1,164 @@
+"""クイズの途中経過の保存と復元
+
+回答状況（QuizState）と現在の問題をニックネーム×デッキ単位でSQLiteに
+保存し、ログインし直したときに復元する。保存はキーごとに最新の状態だけを
+保持しておき、書き込みスレッドがまとめて書き込む（write-behind）。
+"""
+import time
+import atexit
+import threading
+from array import array
+from .config import LOG_DB_PATH
+from .log_store import connect
+from .quiz_state import QuizState
+
+# 書き込みスレッドが溜まった状態を書き込む間隔（秒）
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+SESSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quiz_sessions (
+    user_id TEXT NOT NULL,
+    deck_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    answered BLOB NOT NULL,
+    correct BLOB NOT NULL,
+    positions BLOB NOT NULL,
+    choices BLOB NOT NULL,
+    question_id INTEGER,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, deck_id)
+);
+"""
+
+class SessionStore:
+    """クイズの途中経過を保存するストア"""
+    def __init__(self, db_path=LOG_DB_PATH, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending = {}
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._conn = connect(db_path)
+        self._conn.executescript(SESSION_SCHEMA)
+        self._worker = threading.Thread(
+            target=self._run_worker,
+            name='SessionStoreWriter',
+            daemon=True
+        )
+        self._worker.start()
+        atexit.register(self.close)
+
+    def save(self, user_id, deck_id, session_id, quiz_state, question_id):
+        """途中経過を保存キューに積む（同じキーの古い状態は置き換える）"""
+        row = (
+            str(user_id),
+            str(deck_id),
+            session_id,
+            quiz_state.size,
+            bytes(quiz_state.answered),
+            bytes(quiz_state.correct),
+            quiz_state.positions.tobytes(),
+            bytes(quiz_state.choices),
+            None if question_id is None else int(question_id),
+            time.time()
+        )
+        with self._lock:
+            self._pending[row[:2]] = row
+        self._wakeup.set()
+
+    def discard(self, user_id, deck_id):
+        """保存済みの途中経過を削除"""
+        key = (str(user_id), str(deck_id))
+        try:
+            with self._write_lock, self._conn:
+                with self._lock:
+                    self._pending.pop(key, None)
+                self._conn.execute(
+                    'DELETE FROM quiz_sessions WHERE user_id = ? AND deck_id = ?', key
+                )
+        except Exception as e:
+            print(f"途中経過の削除中にエラーが発生: {str(e)}")
+
+    def load(self, user_id, deck_id):
+        """途中経過を (session_id, QuizState, 現在の問題ID) で返す（なければNone）"""
+        key = (str(user_id), str(deck_id))
+        with self._lock:
+            row = self._pending.get(key)
+        if row is None:
+            with self._write_lock:
+                row = self._conn.execute(
+                    'SELECT user_id, deck_id, session_id, size, answered, correct, '
+                    'positions, choices, question_id, updated_at '
+                    'FROM quiz_sessions WHERE user_id = ? AND deck_id = ?',
+                    key
+                ).fetchone()
+        if row is None:
+            return None
+
+        _, _, session_id, size, answered, correct, positions, choices, question_id, _ = row
+        quiz_state = QuizState(size)
+        quiz_state.answered[:] = answered
+        quiz_state.correct[:] = correct
+        quiz_state.positions = array('I', positions)
+        quiz_state.choices[:] = choices
+        return session_id, quiz_state, question_id
+
+    def _write_pending(self):
+        # 書き込み中に削除された状態を書き戻さないよう、取り出しも書き込みロック内で行う
+        with self._write_lock:
+            with self._lock:
+                rows = list(self._pending.values())
+                self._pending.clear()
+            if rows:
+                self._insert_rows(rows)
+
+    def _insert_rows(self, rows):
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO quiz_sessions '
+                    '(user_id, deck_id, session_id, size, answered, correct, '
+                    'positions, choices, question_id, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    rows
+                )
+        except Exception as e:
+            print(f"途中経過の保存中にエラーが発生: {str(e)}")
+
+    def _run_worker(self):
+        """一定間隔で溜まった途中経過をまとめて書き込むワーカー"""
+        while not self._stop_event.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # 続けて届く更新を1回の書き込みにまとめる
+            self._stop_event.wait(self.flush_interval)
+            self._write_pending()
+
+    def flush(self):
+        """溜まっている途中経過をすべて書き込む"""
+        self._write_pending()
+
+    def close(self):
+        """ワーカーを停止し、残りを書き込んでから閉じる"""
+        if self._worker is not None:
+            self._stop_event.set()
+            self._wakeup.set()
+            self._worker.join(timeout=self.flush_interval + 5)
+            self._worker = None
+            self.flush()
+            self._conn.close()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_session_store():
+    """プロセス内で共有するセッションストア"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore()
+    return _store
@@ -0,0 +1,186 @@
+"""Google Sheets APIクライアントの共有
+
+googleapiclientなどの重いライブラリは、初めてクライアントを作るときに
+読み込む（ログイン画面の表示までに読み込まない）。
+"""
+import os
+import queue
+import hashlib
+import tempfile
+import threading
+
+SCOPE = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+
+# AuthorizedHttpプールのサイズ
+HTTP_POOL_SIZE = 4
+
+# ディスカバリードキュメントのキャッシュ先
+DISCOVERY_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'xlsx_data_app_discovery')
+
+_service_lock = threading.Lock()
+_spreadsheets = None
+_http_pool = None
+
+_setup_lock = threading.Lock()
+_initialized_sheets = set()
+
+class DiscoveryFileCache:
+    """ディスカバリードキュメントをディスクに保存するキャッシュ
+
+    googleapiclientのCacheと同じget/setを持つ。
+    """
+    def __init__(self, cache_dir=DISCOVERY_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, url):
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{name}.json')
+
+    def get(self, url):
+        try:
+            with open(self._path(url), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, url, content):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f'{self._path(url)}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, self._path(url))
+        except OSError as e:
+            print(f"ディスカバリーキャッシュの保存に失敗: {str(e)}")
+
+class AuthorizedHttpPool:
+    """スレッド間で共有するAuthorizedHttpのプール"""
+    def __init__(self, credentials, size=HTTP_POOL_SIZE):
+        self.credentials = credentials
+        self._pool = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self._pool.put(self._new_http())
+
+    def _new_http(self):
+        import google_auth_httplib2
+        import httplib2
+
+        return google_auth_httplib2.AuthorizedHttp(
+            self.credentials, http=httplib2.Http()
+        )
+
+    def acquire(self):
+        return self._pool.get()
+
+    def release(self, http):
+        self._pool.put(http)
+
+class PooledHttpRequestMixin:
+    """実行時にプールからトランスポートを借りるHttpRequest用のミックスイン"""
+    pool = None
+
+    def execute(self, http=None, num_retries=0):
+        if http is not None or self.pool is None:
+            return super().execute(http=http, num_retries=num_retries)
+        pooled_http = self.pool.acquire()
+        try:
+            return super().execute(http=pooled_http, num_retries=num_retries)
+        finally:
+            self.pool.release(pooled_http)
+
+def _load_credentials():
+    """Streamlitのシークレットからサービスアカウント認証情報を作成"""
+    import streamlit as st
+    from google.oauth2 import service_account
+
+    return service_account.Credentials.from_service_account_info(
+        st.secrets["connections"]["gcs"],
+        scopes=SCOPE
+    )
+
+def get_spreadsheets():
+    """プロセス内で共有するspreadsheets()リソースを返す"""
+    global _spreadsheets, _http_pool
+
+    if _spreadsheets is not None:
+        return _spreadsheets
+
+    with _service_lock:
+        if _spreadsheets is not None:
+            return _spreadsheets
+        try:
+            import google_auth_httplib2
+            import httplib2
+            from googleapiclient.discovery import build
+            from googleapiclient.http import HttpRequest
+
+            credentials = _load_credentials()
+            _http_pool = AuthorizedHttpPool(credentials)
+
+            request_class = type(
+                'SharedPooledHttpRequest',
+                (PooledHttpRequestMixin, HttpRequest),
+                {'pool': _http_pool}
+            )
+
+            def build_request(http, *args, **kwargs):
+                return request_class(http, *args, **kwargs)
+
+            service = build(
+                "sheets",
+                "v4",
+                requestBuilder=build_request,
+                http=google_auth_httplib2.AuthorizedHttp(
+                    credentials, http=httplib2.Http()
+                ),
+                cache=DiscoveryFileCache()
+            )
+            _spreadsheets = service.spreadsheets()
+            return _spreadsheets
+        except Exception as e:
+            print(f"Google Sheets接続エラー: {str(e)}")
+            raise
+
+def ensure_sheet(spreadsheet_id, sheet_name, headers=None):
+    """シートの存在確認と初期設定をプロセスで1回だけ行う"""
+    key = (spreadsheet_id, sheet_name)
+    if key in _initialized_sheets:
+        return
+
+    with _setup_lock:
+        if key in _initialized_sheets:
+            return
+        spreadsheets = get_spreadsheets()
+        spreadsheet = spreadsheets.get(
+            spreadsheetId=spreadsheet_id,
+            fields='sheets.properties.title'
+        ).execute()
+
+        sheets = spreadsheet.get('sheets', [])
+        sheet_names = [sheet['properties']['title'] for sheet in sheets]
+
+        if sheet_name not in sheet_names:
+            request = {
+                'addSheet': {
+                    'properties': {
+                        'title': sheet_name
+                    }
+                }
+            }
+            spreadsheets.batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={'requests': [request]}
+            ).execute()
+
+            if headers:
+                spreadsheets.values().update(
+                    spreadsheetId=spreadsheet_id,
+                    range=f'{sheet_name}!A1',
+                    valueInputOption='RAW',
+                    body={'values': [headers]}
+                ).execute()
+
+        _initialized_sheets.add(key)
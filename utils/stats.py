@@ -0,0 +1,121 @@
+import threading
+from datetime import datetime
+from .config import LOG_DB_PATH, JP_TZ
+from .log_store import connect
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answer_rollups (
+    day TEXT NOT NULL,
+    deck_id TEXT NOT NULL DEFAULT '',
+    user_id TEXT NOT NULL,
+    question_id INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    correct INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, deck_id, user_id, question_id)
+);
+"""
+
+_conn_lock = threading.Lock()
+_connections = {}
+
+def _migrate(conn):
+    """deck_idがない古い集計テーブルを作り直す（既存の行はデッキ不明として残す）"""
+    def needs_migration():
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(answer_rollups)')}
+        return bool(columns) and 'deck_id' not in columns
+
+    if not needs_migration():
+        return
+    with conn:
+        # 別のプロセスが先に作り直していないか、書き込みロックを取ってから確かめる
+        conn.execute('BEGIN IMMEDIATE')
+        if not needs_migration():
+            return
+        conn.execute('ALTER TABLE answer_rollups RENAME TO answer_rollups_old')
+        conn.execute(ROLLUP_SCHEMA)
+        conn.execute(
+            "INSERT INTO answer_rollups (day, deck_id, user_id, question_id, attempts, correct) "
+            "SELECT day, '', user_id, question_id, attempts, correct FROM answer_rollups_old"
+        )
+        conn.execute('DROP TABLE answer_rollups_old')
+
+def _get_connection(db_path):
+    """集計テーブル用の共有コネクションを取得"""
+    conn = _connections.get(db_path)
+    if conn is None:
+        conn = connect(db_path)
+        _migrate(conn)
+        conn.executescript(ROLLUP_SCHEMA)
+        _connections[db_path] = conn
+    return conn
+
+def record_answer(user_id, question_id, is_correct, answered_at=None, deck_id=None, db_path=LOG_DB_PATH):
+    """回答1件分を日別・デッキ別・ユーザー別・問題別の集計に加算"""
+    answered_at = answered_at or datetime.now(JP_TZ)
+    day = answered_at.astimezone(JP_TZ).date().isoformat()
+    with _conn_lock:
+        conn = _get_connection(db_path)
+        with conn:
+            conn.execute(
+                'INSERT INTO answer_rollups (day, deck_id, user_id, question_id, attempts, correct) '
+                'VALUES (?, ?, ?, ?, 1, ?) '
+                'ON CONFLICT(day, deck_id, user_id, question_id) DO UPDATE SET '
+                'attempts = attempts + 1, correct = correct + excluded.correct',
+                (day, deck_id or '', str(user_id), int(question_id), 1 if is_correct else 0)
+            )
+
+def _query(sql, params, db_path):
+    with _conn_lock:
+        return _get_connection(db_path).execute(sql, params).fetchall()
+
+def _period(start_date, end_date, deck_id):
+    """期間（とデッキ）で絞り込むWHERE句とパラメータ（deck_idがNoneなら全デッキ）"""
+    where = 'WHERE day BETWEEN ? AND ?'
+    params = [start_date.isoformat(), end_date.isoformat()]
+    if deck_id is not None:
+        where += ' AND deck_id = ?'
+        params.append(deck_id)
+    return where, params
+
+def get_deck_ids(start_date, end_date, db_path=LOG_DB_PATH):
+    """期間内に回答のあったデッキIDの一覧を返す（''はデッキ不明の回答）"""
+    where, params = _period(start_date, end_date, None)
+    return [row[0] for row in _query(
+        f'SELECT DISTINCT deck_id FROM answer_rollups {where} ORDER BY deck_id',
+        params,
+        db_path
+    )]
+
+def get_summary(start_date, end_date, deck_id=None, db_path=LOG_DB_PATH):
+    """期間内（両端を含む）の総回答数と正解数を返す"""
+    where, params = _period(start_date, end_date, deck_id)
+    attempts, correct = _query(
+        'SELECT COALESCE(SUM(attempts), 0), COALESCE(SUM(correct), 0) '
+        f'FROM answer_rollups {where}',
+        params,
+        db_path
+    )[0]
+    return attempts, correct
+
+def get_user_stats(start_date, end_date, deck_id=None, db_path=LOG_DB_PATH):
+    """期間内のユーザー別 (user_id, 回答数, 正解数) を返す"""
+    where, params = _period(start_date, end_date, deck_id)
+    return _query(
+        'SELECT user_id, SUM(attempts), SUM(correct) FROM answer_rollups '
+        f'{where} GROUP BY user_id ORDER BY user_id',
+        params,
+        db_path
+    )
+
+def get_question_stats(start_date, end_date, deck_id=None, db_path=LOG_DB_PATH):
+    """期間内の問題別 (deck_id, question_id, 回答数, 正解数) を返す
+
+    問題番号はデッキごとの番号なので、デッキと組み合わせて集計する。
+    """
+    where, params = _period(start_date, end_date, deck_id)
+    return _query(
+        'SELECT deck_id, question_id, SUM(attempts), SUM(correct) FROM answer_rollups '
+        f'{where} GROUP BY deck_id, question_id ORDER BY deck_id, question_id',
+        params,
+        db_path
+    )
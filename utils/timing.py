@@ -0,0 +1,224 @@
+"""処理時間の計測（スパン）とヒストグラムによる集計
+
+    with span('load_data'):
+        ...
+
+    @timed('show_quiz_screen')
+    def show_quiz_screen(...):
+        ...
+
+計測値はプロセス内の対数スケールのヒストグラムに加算するだけなので
+オーバーヘッドは小さい。バックグラウンドのスレッドが一定間隔で前回からの
+増分をログDBのperf_spansテーブルに書き出し、管理者画面で集計して表示する。
+"""
+import json
+import time
+import bisect
+import atexit
+import inspect
+import functools
+import threading
+import contextlib
+from datetime import datetime
+from .config import LOG_DB_PATH, JP_TZ
+from .log_store import connect, to_db_timestamp
+
+# ログDBへの書き出し間隔（秒）
+EXPORT_INTERVAL = 60.0
+
+# バケットの上限（ミリ秒）。0.01msから約100秒まで、2^(1/4)倍ずつ
+BUCKET_BOUNDS = [0.01 * 2 ** (i / 4) for i in range(94)]
+
+PERF_SCHEMA = """
+CREATE TABLE IF NOT EXISTS perf_spans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TIMESTAMP NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total_ms REAL NOT NULL,
+    max_ms REAL NOT NULL,
+    buckets TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_perf_spans_created_at ON perf_spans(created_at);
+"""
+
+class Histogram:
+    """対数スケールのバケットで処理時間の分布を数える"""
+    __slots__ = ('counts', 'count', 'total_ms', 'max_ms')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def merge(self, counts, count, total_ms, max_ms):
+        for index, n in counts.items():
+            self.counts[int(index)] += n
+        self.count += count
+        self.total_ms += total_ms
+        self.max_ms = max(self.max_ms, max_ms)
+
+    def percentile(self, q):
+        """q（0〜1）分位点の近似値（バケットの上限、最大値を超えない）"""
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for index, n in enumerate(self.counts):
+            cumulative += n
+            if cumulative >= target and n:
+                bound = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max_ms
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else None,
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max_ms,
+        }
+
+_lock = threading.Lock()
+# プロセス起動からの累計と、まだ書き出していない増分
+_histograms = {}
+_pending = {}
+_exporter = None
+
+def record(name, ms):
+    """計測値（ミリ秒）をヒストグラムに加算"""
+    with _lock:
+        for histograms in (_histograms, _pending):
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram()
+            histogram.add(ms)
+    if _exporter is None:
+        _start_exporter()
+
+@contextlib.contextmanager
+def span(name):
+    """withブロックの処理時間を計測"""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - started_at) * 1000)
+
+def timed(name=None):
+    """関数（コルーチン関数を含む）の処理時間を計測するデコレータ"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def snapshot():
+    """このプロセスでの計測結果を {名前: 集計値} で返す"""
+    with _lock:
+        return {name: histogram.summary() for name, histogram in sorted(_histograms.items())}
+
+def export_spans(db_path=LOG_DB_PATH):
+    """前回の書き出し以降の計測結果をログDBに書き出す"""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return 0
+
+    created_at = to_db_timestamp(datetime.now(JP_TZ))
+    rows = [
+        (
+            created_at,
+            name,
+            histogram.count,
+            histogram.total_ms,
+            histogram.max_ms,
+            json.dumps({index: n for index, n in enumerate(histogram.counts) if n})
+        )
+        for name, histogram in pending.items()
+    ]
+    conn = connect(db_path)
+    try:
+        conn.executescript(PERF_SCHEMA)
+        with conn:
+            conn.executemany(
+                'INSERT INTO perf_spans (created_at, name, count, total_ms, max_ms, buckets) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+    finally:
+        conn.close()
+    return len(rows)
+
+def query_spans(start=None, end=None, db_path=LOG_DB_PATH):
+    """ログDBの計測結果を名前ごとに集計して返す（endは含まない）"""
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append('created_at >= ?')
+        params.append(to_db_timestamp(start))
+    if end is not None:
+        conditions.append('created_at < ?')
+        params.append(to_db_timestamp(end))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    conn = connect(db_path)
+    try:
+        conn.executescript(PERF_SCHEMA)
+        rows = conn.execute(
+            f'SELECT name, count, total_ms, max_ms, buckets FROM perf_spans {where}',
+            params
+        ).fetchall()
+    finally:
+        conn.close()
+
+    histograms = {}
+    for name, count, total_ms, max_ms, buckets in rows:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.merge(json.loads(buckets), count, total_ms, max_ms)
+    return {name: histogram.summary() for name, histogram in sorted(histograms.items())}
+
+def _export_loop(stop_event):
+    while not stop_event.wait(EXPORT_INTERVAL):
+        try:
+            export_spans()
+        except Exception as e:
+            print(f"計測結果の書き出し中にエラーが発生: {str(e)}")
+
+def _start_exporter():
+    global _exporter
+    with _lock:
+        if _exporter is not None:
+            return
+        _exporter = threading.Thread(
+            target=_export_loop,
+            args=(threading.Event(),),
+            name='SpanExporter',
+            daemon=True
+        )
+        _exporter.start()
+    atexit.register(export_spans)